@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import data
+import profiling
+import synthetic
+from data import (change_degree_type, company_size, normalise_degree_types,
+                  normalise_company_sizes, process_data, read_data)
+from indicators import Indicators, indicator_specs, run_spec
+from lists import postgrad, undergrad, phil, mba, judge
+
+# Stages timed by the --pipeline flag.
+PIPELINE_REPORT = '../data/interim/pipeline_benchmark.csv'
+
+
+def timeit(func, *args, **kwargs):
+    """Run a function and measure its wall time.
+
+    Return:
+        (:obj:`tuple`): The output of the function and the seconds it took.
+
+    """
+    start = time.time()
+    out = func(*args, **kwargs)
+    return out, time.time() - start
+
+
+def normalisation_benchmark(n_rows=3000000, seed=0):
+    """Compare the row-wise and the vectorised degree type and company size
+    normalisation on columns shaped like those of ojpd.
+
+    Args:
+        n_rows (:obj:`int`): Number of rows.
+        seed (:obj:`int`): Seed of the random generator.
+
+    Return:
+        (:obj:`pandas.DataFrame`): Seconds taken by each implementation and
+            the speedup, per column.
+
+    """
+    rng = np.random.RandomState(seed)
+    degrees = postgrad + undergrad + phil + mba + judge + [
+        'unknown', 'Unknown', 'Diploma', 'High School', None]
+    sizes = ['1-10', '11-50', '51-100', '101-250', '251-500', '501-1000',
+             '1001-5000', '5001-10000', '10000+', 'unknown', None]
+    columns = {
+        'degree_type': (pd.Series(rng.choice(degrees, n_rows)),
+                        change_degree_type, normalise_degree_types),
+        'employee_count': (pd.Series(rng.choice(sizes, n_rows)),
+                           company_size, normalise_company_sizes),
+    }
+
+    results = {}
+    for col, (series, func, vectorised) in columns.items():
+        expected, t_apply = timeit(series.apply, func)
+        out, t_vectorised = timeit(vectorised, series)
+        pd.testing.assert_series_equal(out, expected, check_dtype=False)
+        results[col] = {'apply': t_apply, 'vectorised': t_vectorised,
+                        'speedup': t_apply / t_vectorised}
+    return pd.DataFrame.from_dict(results, orient='index')
+
+
+@contextmanager
+def sqlite_database():
+    """Make data read the tables of a SQLite file: the config file passed to
+    read_data is the path of the file."""
+    get_engine = data.get_engine
+    data.get_engine = synthetic.sqlite_engine
+    try:
+        yield
+    finally:
+        data.get_engine = get_engine
+
+
+def pipeline_benchmark(n_rows=100000, seed=0, country='Germany',
+                       work_dir=None):
+    """Time read_data, the stages of process_data and every indicator spec on
+    synthetic tables, see synthetic.iter_tables. The organisations of Europe
+    are processed, like the real ones.
+
+    Args:
+        n_rows (:obj:`int`): Approximate number of rows of the tables.
+        seed (:obj:`int`): Seed of the random generator.
+        country (:obj:`str`): Country of the city level indicators.
+        work_dir (:obj:`str` | :obj:`NoneType`): Directory of the database
+            and the output. Defaults to a new temporary directory.
+
+    Return:
+        (:obj:`pandas.DataFrame`): Profiled stages, see profiling.stage.
+            Every indicator spec is computed on a new Indicators, so its time
+            includes the views it builds.
+
+    """
+    work_dir = work_dir or tempfile.mkdtemp()
+    os.makedirs(work_dir, exist_ok=True)
+    database = os.path.join(work_dir, 'crunchbase.db')
+    synthetic.write_database(database, n_rows, seed)
+
+    profiling.enable()
+    try:
+        with sqlite_database():
+            dfs = read_data(database)
+        orgs, geo = dfs[0], dfs[3]
+        org_ids = orgs.id[orgs.location_id.isin(
+            geo.id[geo.continent == 'Europe'])]
+
+        ojpd = process_data(dfs, org_ids, os.path.join(work_dir, 'ojpd.csv'))
+
+        for spec in indicator_specs(country):
+            run_spec(spec, Indicators(ojpd))
+    finally:
+        records = profiling.disable()
+    return pd.DataFrame(records, columns=profiling.FIELDS)
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if '--pipeline' in sys.argv:
+        n_rows = int(args[0]) if args else 100000
+        report = pipeline_benchmark(n_rows)
+        print(report.to_string())
+        report.to_csv(PIPELINE_REPORT, index=False)
+    else:
+        n_rows = int(args[0]) if args else 3000000
+        print(normalisation_benchmark(n_rows))
@@ -0,0 +1,85 @@
+import os
+import json
+
+import pyarrow as pa
+
+
+def cache_paths(cache_dir, table):
+    """Paths of the Arrow file and the metadata of a cached table.
+
+    Args:
+        cache_dir (:obj:`str`): Cache directory.
+        table (:obj:`str`): Table name.
+
+    Return:
+        (:obj:`tuple` of :obj:`str`)
+
+    """
+    return (os.path.join(cache_dir, '{}.arrow'.format(table)),
+            os.path.join(cache_dir, '{}.json'.format(table)))
+
+
+def read_marker(cache_dir, table):
+    """Read the change marker saved with a cached table.
+
+    Args:
+        cache_dir (:obj:`str`): Cache directory.
+        table (:obj:`str`): Table name.
+
+    Return:
+        (:obj:`dict` | :obj:`NoneType`): Row count, last update and columns
+            of the cached table or None if the table is not cached.
+
+    """
+    _, marker_path = cache_paths(cache_dir, table)
+    if not os.path.exists(marker_path):
+        return None
+    with open(marker_path) as h:
+        return json.load(h)
+
+
+def load(cache_dir, table, columns=None):
+    """Load a cached table from a memory-mapped Arrow file.
+
+    Args:
+        cache_dir (:obj:`str`): Cache directory.
+        table (:obj:`str`): Table name.
+        columns (:obj:`list` of :obj:`str` | :obj:`NoneType`): Columns to
+            load. Defaults to all columns.
+
+    Return:
+        (:obj:`pandas.DataFrame`)
+
+    """
+    arrow_path, _ = cache_paths(cache_dir, table)
+    source = pa.memory_map(arrow_path, 'r')
+    arrow_table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        arrow_table = pa.Table.from_arrays(
+            [arrow_table.column(col) for col in columns], names=columns)
+    return arrow_table.to_pandas()
+
+
+def save(cache_dir, table, df, marker):
+    """Write a table and its change marker to the cache. Files are replaced
+    atomically so that readers never see a partial table.
+
+    Args:
+        cache_dir (:obj:`str`): Cache directory.
+        table (:obj:`str`): Table name.
+        df (:obj:`pandas.DataFrame`): Table contents.
+        marker (:obj:`dict`): Row count, last update and columns of the
+            table.
+
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    arrow_path, marker_path = cache_paths(cache_dir, table)
+    arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(arrow_path + '.tmp', 'wb') as sink:
+        writer = pa.RecordBatchFileWriter(sink, arrow_table.schema)
+        writer.write_table(arrow_table)
+        writer.close()
+    with open(marker_path + '.tmp', 'w') as h:
+        json.dump(marker, h)
+    os.replace(arrow_path + '.tmp', arrow_path)
+    os.replace(marker_path + '.tmp', marker_path)
@@ -1,55 +1,422 @@
+import os
 import re
 import sys
+import time
 import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 import ethnicolr
+from sqlalchemy import bindparam, inspect, text
 from data_getters.core import get_engine
-from lists import postgrad, undergrad, phil, mba, judge, ethnicities
+import cache
+import profiling
+from lists import postgrad, undergrad, phil, mba, judge, tables, categoricals
 
 
-def concat_chunks(chunks):
-    """Concatenate a list of DataFrames to a DataFrame.
+# Columns of each table used by prepare_data and the dtype they are stored
+# as. Columns not listed as float are kept as Python objects.
+TABLES = {
+    'crunchbase_organizations': ['id', 'funding_total_usd', 'founded_on',
+                                 'employee_count', 'primary_role',
+                                 'location_id'],
+    'crunchbase_organizations_categories': ['organization_id',
+                                            'category_name'],
+    'crunchbase_category_groups': ['category_name', 'category_group_list'],
+    'geographic_data': ['id', 'city', 'country', 'country_alpha_2',
+                        'country_alpha_3', 'continent', 'latitude',
+                        'longitude'],
+    'crunchbase_degrees': ['person_id', 'degree_type', 'degree_id',
+                           'institution_id'],
+    'crunchbase_jobs': ['person_id', 'org_id', 'job_id', 'is_current',
+                        'job_type'],
+    'crunchbase_people': ['id', 'first_name', 'last_name', 'gender'],
+}
+FLOAT_COLUMNS = {'funding_total_usd', 'latitude', 'longitude', 'is_current'}
+
+# Primary keys of the tables that can be refreshed incrementally from the rows
+# whose UPDATED_COLUMN changed since they were cached.
+TABLE_KEYS = {
+    'crunchbase_organizations': 'id',
+    'crunchbase_degrees': 'degree_id',
+    'crunchbase_jobs': 'job_id',
+    'crunchbase_people': 'id',
+}
+UPDATED_COLUMN = 'updated_at'
+CACHE_DIR = '../data/interim/crunchbase_cache'
+
+COMPANY_SIZE_REGEX = re.compile(r'\d+')
+
+# Normalised degree type of every degree in lists.py. The groups are listed
+# in reverse so that earlier ones take precedence, as in change_degree_type.
+DEGREE_TYPES = {degree: degree_type
+                for degree_type, degrees in [('JD', judge), ('MBA', mba),
+                                             ('Undergraduate', undergrad),
+                                             ('Postgraduate', postgrad),
+                                             ('PhD', phil),
+                                             (np.nan, ['unknown', 'Unknown'])]
+                for degree in degrees}
+
+# Cached ethnicity predictions, keyed by first and last name.
+NAME_RACE_TABLE = 'name_race'
+NAME_COLUMNS = ['first_name', 'last_name']
+
+# Conditions selecting the rows of a batch of organisations in each table
+# that is not read whole when streaming.
+JOB_PEOPLE = 'SELECT person_id FROM crunchbase_jobs WHERE org_id IN :org_ids'
+BATCH_FILTERS = {
+    'crunchbase_organizations': 'id IN :org_ids',
+    'crunchbase_organizations_categories': 'organization_id IN :org_ids',
+    'crunchbase_jobs': 'org_id IN :org_ids',
+    'crunchbase_people': 'id IN ({})'.format(JOB_PEOPLE),
+    'crunchbase_degrees': 'person_id IN ({})'.format(JOB_PEOPLE),
+}
+STREAM_BATCH_SIZE = 10000
+
+# Stage timings and memory written by the --profile flag.
+PROFILE_REPORT = '../data/interim/prepare_data_profile.json'
+
+# Columns of the processed dataset, in the order they are written.
+OUTPUT_COLUMNS = ['org_id', 'funding_total_usd', 'founded_on', 'city',
+                  'country', 'employee_count', 'primary_role',
+                  'country_alpha_2', 'country_alpha_3', 'continent',
+                  'latitude', 'longitude', 'job_id', 'is_current', 'job_type',
+                  'category_group_list', 'person_id', 'first_name',
+                  'last_name', 'gender', 'race', 'degree_type', 'degree_id',
+                  'institution_id']
+
+# The orgs -> geo -> jobs -> categories -> people -> degrees merge chain of
+# prepare_data, restricted to the organisations in tmp_org_ids.
+SUBSET_QUERY = """
+SELECT o.id AS org_id, o.funding_total_usd, o.founded_on, g.city, g.country,
+       o.employee_count, o.primary_role, g.country_alpha_2, g.country_alpha_3,
+       g.continent, g.latitude, g.longitude, j.job_id, j.is_current,
+       j.job_type, c.category_group_list, p.id AS person_id, p.first_name,
+       p.last_name, p.gender, d.degree_type, d.degree_id, d.institution_id
+FROM tmp_org_ids t
+JOIN crunchbase_organizations o ON o.id = t.id
+LEFT JOIN geographic_data g ON g.id = o.location_id
+LEFT JOIN crunchbase_jobs j ON j.org_id = o.id
+LEFT JOIN (SELECT oc.organization_id, cg.category_group_list
+           FROM crunchbase_organizations_categories oc
+           JOIN crunchbase_category_groups cg
+           ON cg.category_name = oc.category_name) c
+ON c.organization_id = o.id
+LEFT JOIN crunchbase_people p ON p.id = j.person_id
+LEFT JOIN crunchbase_degrees d ON d.person_id = p.id
+"""
+
+
+def read_table(con, table, columns, chunksize=100000, where=None,
+               params=None):
+    """Stream the columns of a table into preallocated arrays and build the
+    DataFrame once.
+
+    Args:
+        con (:obj:`sqlalchemy.engine.Engine`): Database engine.
+        table (:obj:`str`): Table name.
+        columns (:obj:`list` of :obj:`str`): Columns to select.
+        chunksize (:obj:`int`): Number of rows fetched per round trip.
+        where (:obj:`str` | :obj:`NoneType`): SQL condition on the rows.
+        params (:obj:`dict` | :obj:`NoneType`): Parameters of the condition.
+            List values are expanded, e.g. for IN conditions.
+
+    Return:
+        (:obj:`pandas.DataFrame`)
+
+    """
+    where = ' WHERE {}'.format(where) if where else ''
+    params = params or {}
+    expanding = [bindparam(key, expanding=True)
+                 for key, value in params.items() if isinstance(value, list)]
+
+    def query(sql):
+        return text(sql).bindparams(*expanding)
+
+    with con.connect() as conn:
+        n_rows = conn.execute(query('SELECT COUNT(*) FROM {}{}'
+                                    .format(table, where)), params).scalar()
+        arrays = {col: np.empty(n_rows, dtype=float if col in FLOAT_COLUMNS
+                                else object) for col in columns}
+        result = conn.execution_options(stream_results=True).execute(
+            query('SELECT {} FROM {}{}'.format(', '.join(columns), table,
+                                               where)), params)
+        offset = 0
+        while True:
+            rows = result.fetchmany(chunksize)
+            if not rows:
+                break
+            end = offset + len(rows)
+            # The table grew between the count and the select.
+            if end > n_rows:
+                n_rows = max(end, 2 * n_rows)
+                arrays = {col: np.resize(arr, n_rows)
+                          for col, arr in arrays.items()}
+            for col, values in zip(columns, zip(*rows)):
+                arrays[col][offset:end] = values
+            offset = end
+    return pd.DataFrame({col: arrays[col][:offset] for col in columns},
+                        columns=columns)
+
+
+def table_marker(con, table):
+    """Find the row count and the last update of a table.
+
+    Args:
+        con (:obj:`sqlalchemy.engine.Engine`): Database engine.
+        table (:obj:`str`): Table name.
+
+    Return:
+        (:obj:`dict`): The row count and the latest value of UPDATED_COLUMN,
+            None if the table does not have it.
+
+    """
+    columns = {col['name'] for col in inspect(con).get_columns(table)}
+    updated = 'MAX({})'.format(UPDATED_COLUMN) \
+        if UPDATED_COLUMN in columns else 'NULL'
+    with con.connect() as conn:
+        count, updated_at = conn.execute(text(
+            'SELECT COUNT(*), {} FROM {}'.format(updated, table))).first()
+    return {'count': count,
+            'updated_at': None if updated_at is None else str(updated_at)}
+
+
+def read_cached_table(con, table, columns, cache_dir):
+    """Read a table through the local cache. The cached copy is used as is
+    when the table has not changed. Tables with a primary key and an update
+    timestamp are refreshed with the rows changed since they were cached;
+    any other change reloads the whole table.
 
     Args:
-        chunks (:obj:`list` of :obj:`pandas.DataFrame`): List of DataFrames.
+        con (:obj:`sqlalchemy.engine.Engine`): Database engine.
+        table (:obj:`str`): Table name.
+        columns (:obj:`list` of :obj:`str`): Columns to return.
+        cache_dir (:obj:`str`): Cache directory.
 
     Return:
-        (:obj: of `pandas.DataFrame`)
+        (:obj:`pandas.DataFrame`)
 
     """
-    return pd.concat([chunk for chunk in chunks])
+    marker = table_marker(con, table)
+    key = TABLE_KEYS.get(table)
+    incremental = key is not None and marker['updated_at'] is not None
+    stored = list(columns)
+    if incremental:
+        stored += [col for col in [key, UPDATED_COLUMN] if col not in stored]
+    marker['columns'] = stored
+
+    cached = cache.read_marker(cache_dir, table)
+    if cached is not None and set(columns) <= set(cached['columns']):
+        if (cached['count'] == marker['count']
+                and cached['updated_at'] == marker['updated_at']):
+            return cache.load(cache_dir, table, columns)
+        if (incremental and cached['updated_at'] is not None
+                and set(stored) <= set(cached['columns'])):
+            delta = read_table(con, table, stored,
+                               where='{} >= :since'.format(UPDATED_COLUMN),
+                               params={'since': cached['updated_at']})
+            df = cache.load(cache_dir, table, stored)
+            df = pd.concat([df[~df[key].isin(delta[key])], delta],
+                           ignore_index=True)
+            # Deleted rows cannot be seen in the delta.
+            if df.shape[0] == marker['count']:
+                cache.save(cache_dir, table, df, marker)
+                return df[columns]
+
+    df = read_table(con, table, stored)
+    cache.save(cache_dir, table, df, marker)
+    return df[columns]
 
 
 # "../innovation-mapping.config"
-def read_data(config_file):
+def read_data(config_file, tables=TABLES, max_workers=None, cache_dir=None,
+              offline=False):
+    """Read the Crunchbase tables concurrently.
+
+    Args:
+        config_file (:obj:`str`): Path to the database config file.
+        tables (:obj:`dict`): Table names mapped to the columns to select.
+        max_workers (:obj:`int` | :obj:`NoneType`): Number of tables read at
+            the same time. Defaults to one thread per table.
+        cache_dir (:obj:`str` | :obj:`NoneType`): If given, the tables are
+            read through a local cache in this directory. Defaults to None.
+        offline (:obj:`bool`): If True, the tables are loaded from cache_dir
+            without connecting to the database. Defaults to False.
+
+    Return:
+        (:obj:`tuple` of :obj:`pandas.DataFrame`): One DataFrame per table,
+            in the order of `tables`.
+
+    """
+    con = None if offline else get_engine(config_file)
+
+    def timed_read(table):
+        start = time.time()
+        with profiling.stage('read_{}'.format(table)) as stage:
+            if offline:
+                df = cache.load(cache_dir, table, tables[table])
+            elif cache_dir is not None:
+                df = read_cached_table(con, table, tables[table], cache_dir)
+            else:
+                df = read_table(con, table, tables[table])
+            stage.output(df)
+        print('{}: {} rows in {:.2f}s'.format(table, df.shape[0],
+                                              time.time() - start))
+        return df
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(tables)) as pool:
+        dfs = list(pool.map(timed_read, tables))
+    if con is not None:
+        con.dispose()
+    return tuple(dfs)
+
+
+def read_subset(config_file, org_ids, chunksize=10000):
+    """Join the Crunchbase tables in the database, keeping only the given
+    organisations. The ids are uploaded to a temporary table so that only
+    the relevant rows are sent back.
+
+    Args:
+        config_file (:obj:`str`): Path to the database config file.
+        org_ids (:obj:`iterable` of :obj:`str`): Organisation IDs to keep.
+        chunksize (:obj:`int`): Number of IDs inserted per round trip.
+
+    Return:
+        (:obj:`pandas.DataFrame`): Organisations joined with their location,
+            jobs, categories, people and degrees.
+
+    """
     con = get_engine(config_file)
+    org_ids = list(set(org_ids))
+    with con.begin() as conn:
+        conn.execute(text('CREATE TEMPORARY TABLE tmp_org_ids '
+                          '(id VARCHAR(255) PRIMARY KEY)'))
+        for i in range(0, len(org_ids), chunksize):
+            conn.execute(text('INSERT INTO tmp_org_ids (id) VALUES (:id)'),
+                         [{'id': id_} for id_ in org_ids[i:i + chunksize]])
+        df = pd.read_sql_query(text(SUBSET_QUERY), conn)
+        conn.execute(text('DROP TABLE tmp_org_ids'))
+    con.dispose()
+    return df
+
+
+def predict_race(names):
+    """Predict the ethnicity of a batch of names with ethnicolr.
+
+    Args:
+        names (:obj:`pandas.DataFrame`): Unique first_name and last_name
+            pairs.
+
+    Return:
+        (:obj:`pandas.DataFrame`): The names and their race.
+
+    """
+    return ethnicolr.pred_wiki_name(df=names, lname_col='last_name',
+                                    fname_col='first_name')[NAME_COLUMNS
+                                                            + ['race']]
+
 
-    orgs = concat_chunks(pd.read_sql_table('crunchbase_organizations', con,
-                                           chunksize=1000))
-    cats = concat_chunks(
-                        pd.read_sql_table(
-                                         'crunchbase_organizations_categories',
-                                         con, chunksize=1000))
-    cat_groups = concat_chunks(pd.read_sql_table('crunchbase_category_groups',
-                                                 con, chunksize=1000))
-    geo = concat_chunks(pd.read_sql_table('geographic_data', con,
-                                          chunksize=1000))
-    degrees = concat_chunks(pd.read_sql_table('crunchbase_degrees', con,
-                                              chunksize=1000))
-    jobs = concat_chunks(pd.read_sql_table('crunchbase_jobs', con,
-                                           chunksize=1000))
-    people = concat_chunks(pd.read_sql_table('crunchbase_people', con,
-                                             chunksize=1000))
-    return orgs, cats, cat_groups, geo, degrees, jobs, people
+class NameRaces():
+    """Ethnicity predictions of first and last names, kept in memory so
+    that names seen in earlier calls are not predicted again.
+
+    Args:
+        cache_dir (:obj:`str` | :obj:`NoneType`): If given, predictions are
+            loaded from this directory and written back by save. Defaults
+            to None.
+
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.changed = False
+        if cache_dir is not None and \
+                cache.read_marker(cache_dir, NAME_RACE_TABLE) is not None:
+            self.races = cache.load(cache_dir, NAME_RACE_TABLE)
+        else:
+            self.races = pd.DataFrame(columns=NAME_COLUMNS + ['race'])
+
+    def predict(self, names, batch_size=100000, n_jobs=1):
+        """Predict the names that are not known yet.
+
+        Args:
+            names (:obj:`pandas.DataFrame`): Unique first_name and last_name
+                pairs.
+            batch_size (:obj:`int`): Number of names passed to the model at
+                once.
+            n_jobs (:obj:`int`): Number of processes predicting batches in
+                parallel. Defaults to 1.
+
+        Return:
+            (:obj:`pandas.DataFrame`): All known names and their race.
+
+        """
+        names = names[~names.set_index(NAME_COLUMNS).index
+                           .isin(self.races.set_index(NAME_COLUMNS).index)]
+        batches = [names.iloc[i:i + batch_size]
+                   for i in range(0, names.shape[0], batch_size)]
+        if n_jobs > 1 and len(batches) > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                predicted = list(pool.map(predict_race, batches))
+        else:
+            predicted = [predict_race(batch) for batch in batches]
+        if predicted:
+            self.races = pd.concat([self.races] + predicted,
+                                   ignore_index=True)
+            self.changed = True
+        return self.races
+
+    def save(self):
+        """Write the predictions to the cache if any were added."""
+        if self.cache_dir is not None and self.changed:
+            cache.save(self.cache_dir, NAME_RACE_TABLE, self.races,
+                       {'count': self.races.shape[0]})
+            self.changed = False
+
+
+def predict_ethnicity(df, cache_dir=None, batch_size=100000, n_jobs=1,
+                      races=None):
+    """Clean the gender and predict the ethnicity of the people in a
+    DataFrame from their first and last name. Every name is predicted once
+    and joined back to the rows. People without a first or last name get no
+    prediction.
+
+    Args:
+        df (:obj:`pandas.DataFrame`): Must contain the first_name, last_name
+            and gender columns.
+        cache_dir (:obj:`str` | :obj:`NoneType`): If given, predictions are
+            stored in and reused from this directory. Defaults to None.
+        batch_size (:obj:`int`): Number of names passed to the model at once.
+        n_jobs (:obj:`int`): Number of processes predicting batches in
+            parallel. Defaults to 1.
+        races (:obj:`NameRaces` | :obj:`NoneType`): Predictions shared
+            between calls. If given, cache_dir is ignored and the caller
+            saves the predictions. Defaults to None.
+
+    Return:
+        (:obj:`pandas.DataFrame`): The input with an additional race column.
+
+    """
+    df.gender = df.gender.apply(lambda x: x if x != 'not_provided'
+                                else np.nan)
+    names = df[NAME_COLUMNS].dropna().drop_duplicates()
+
+    shared = races is not None
+    if not shared:
+        races = NameRaces(cache_dir)
+    # Predict ethnicity given first and last name
+    known = races.predict(names, batch_size=batch_size, n_jobs=n_jobs)
+    if not shared:
+        races.save()
+    return df.merge(known, how='left', on=NAME_COLUMNS)
 
 
 def company_size(val):
-    regex = re.compile(r'\d+')
     if isinstance(val, str):
-        values = [int(v) for v in re.findall(regex, val)]
+        values = [int(v) for v in re.findall(COMPANY_SIZE_REGEX, val)]
     else:
         return val
     if val == 'unknown':
@@ -86,6 +453,52 @@ def change_degree_type(val):
         return val
 
 
+def map_unique(series, func):
+    """Apply a function once to every distinct value of a Series and
+    broadcast the results back to the rows.
+
+    Args:
+        series (:obj:`pandas.Series`)
+        func (:obj:`function`): Function applied to a single value.
+
+    Return:
+        (:obj:`pandas.Series`)
+
+    """
+    codes, uniques = pd.factorize(series)
+    # Missing values have code -1 and pick the last element.
+    mapped = np.empty(len(uniques) + 1, dtype=object)
+    mapped[:-1] = [func(val) for val in uniques]
+    mapped[-1] = func(np.nan)
+    return pd.Series(mapped[codes], index=series.index, name=series.name)
+
+
+def normalise_degree_types(series):
+    """Vectorised change_degree_type.
+
+    Args:
+        series (:obj:`pandas.Series`): Degree types.
+
+    Return:
+        (:obj:`pandas.Series`)
+
+    """
+    return map_unique(series, lambda val: DEGREE_TYPES.get(val, val))
+
+
+def normalise_company_sizes(series):
+    """Vectorised company_size.
+
+    Args:
+        series (:obj:`pandas.Series`): Employee counts.
+
+    Return:
+        (:obj:`pandas.Series`)
+
+    """
+    return map_unique(series, company_size)
+
+
 def bin_values(arr):
     low_values_flags = arr < np.max(arr)
     arr[low_values_flags] = 0
@@ -93,53 +506,340 @@ def bin_values(arr):
     return arr
 
 
-def prepare_data():
-    orgs, cats, cat_groups, geo, degrees, jobs, people = read_data(sys.argv[1])
-    with open(sys.argv[2], 'rb') as h:
-        org_ids = pickle.load(h)
+def merge_tables(orgs, cats, cat_groups, geo, degrees, jobs, people,
+                 org_ids, cache_dir=None, n_jobs=1, races=None):
+    """Merge the Crunchbase tables of the given organisations in memory.
+
+    Args:
+        orgs, cats, cat_groups, geo, degrees, jobs, people
+            (:obj:`pandas.DataFrame`): Tables returned by read_data.
+        org_ids (:obj:`iterable` of :obj:`str`): Organisation IDs to keep.
+        cache_dir (:obj:`str` | :obj:`NoneType`): Cache of the ethnicity
+            predictions. Defaults to None.
+        n_jobs (:obj:`int`): Number of processes predicting ethnicities.
+        races (:obj:`NameRaces` | :obj:`NoneType`): Ethnicity predictions
+            shared with other calls. Defaults to None.
+
+    Return:
+        (:obj:`pandas.DataFrame`)
 
-    orgs = orgs[(orgs.id.isin(org_ids))]
-    orgs = orgs.merge(geo, how='left', left_on='location_id', right_on='id')
+    """
+    with profiling.stage('filter_orgs', orgs) as stage:
+        orgs = stage.output(orgs[(orgs.id.isin(org_ids))])
+    with profiling.stage('merge_geo', orgs) as stage:
+        orgs = orgs.merge(geo, how='left', left_on='location_id',
+                          right_on='id')
+        stage.output(orgs)
     orgs.rename(index=str, inplace=True, columns={'id_x': 'id',
                 'country_y': 'country', 'city_y': 'city'})
-    oj = orgs[['id', 'funding_total_usd', 'founded_on', 'city', 'country',
-               'employee_count', 'primary_role', 'country_alpha_2',
-               'country_alpha_3', 'continent', 'latitude', 'longitude']].merge(
-                                                jobs[['person_id', 'org_id',
-                                                      'job_id', 'is_current',
-                                                      'job_type']], how='left',
-                                                left_on='id',
-                                                right_on='org_id')
-
-    categories = cats.merge(cat_groups, left_on='category_name',
-                            right_on='category_name')
-
-    oj = oj.merge(categories[['organization_id', 'category_group_list']],
-                  how='left', left_on='id', right_on='organization_id')
-
-    ojp = oj.merge(people[['id', 'first_name', 'last_name', 'gender']],
-                   how='left', left_on='person_id', right_on='id')
-
-    ojp.gender = ojp.gender.apply(lambda x: x if x != 'not_provided'
-                                  else np.nan)
-    # Predict ethnicity given first and last name
-    ojp = ethnicolr.pred_wiki_name(df=ojp, lname_col='last_name',
-                                   fname_col='first_name')
-    ojp.drop(ethnicities, axis=1, inplace=True)
-    ojpd = ojp.merge(degrees[['person_id', 'degree_type', 'degree_id',
-                              'institution_id']],
-                     how='left', left_on='id_y', right_on='person_id')
+    with profiling.stage('merge_jobs', orgs) as stage:
+        oj = orgs[['id', 'funding_total_usd', 'founded_on', 'city',
+                   'country', 'employee_count', 'primary_role',
+                   'country_alpha_2', 'country_alpha_3', 'continent',
+                   'latitude', 'longitude']].merge(
+                       jobs[['person_id', 'org_id', 'job_id', 'is_current',
+                             'job_type']],
+                       how='left', left_on='id', right_on='org_id')
+        stage.output(oj)
+
+    with profiling.stage('merge_category_groups', cats) as stage:
+        categories = cats.merge(cat_groups, left_on='category_name',
+                                right_on='category_name')
+        stage.output(categories)
+
+    with profiling.stage('merge_categories', oj) as stage:
+        oj = oj.merge(categories[['organization_id', 'category_group_list']],
+                      how='left', left_on='id', right_on='organization_id')
+        stage.output(oj)
+
+    with profiling.stage('merge_people', oj) as stage:
+        ojp = oj.merge(people[['id', 'first_name', 'last_name', 'gender']],
+                       how='left', left_on='person_id', right_on='id')
+        stage.output(ojp)
+
+    with profiling.stage('predict_ethnicity', ojp) as stage:
+        ojp = predict_ethnicity(ojp, cache_dir=cache_dir, n_jobs=n_jobs,
+                                races=races)
+        stage.output(ojp)
+
+    with profiling.stage('merge_degrees', ojp) as stage:
+        ojpd = ojp.merge(degrees[['person_id', 'degree_type', 'degree_id',
+                                  'institution_id']],
+                         how='left', left_on='id_y', right_on='person_id')
+        stage.output(ojpd)
     ojpd.drop(['person_id_x', 'person_id_y', 'organization_id', 'org_id'],
               axis=1, inplace=True)
     ojpd.rename(index=str, inplace=True, columns={'id_x': 'org_id',
                                                   'id_y': 'person_id'})
+    return ojpd
+
+
+def build_tables(orgs, cats, cat_groups, geo, degrees, jobs, people,
+                 org_ids, cache_dir=None, n_jobs=1):
+    """Build the processed dataset of the given organisations as normalised
+    tables (see lists.tables) instead of merging them into one DataFrame.
+    Joining the tables gives back the output of merge_tables.
+
+    Args:
+        orgs, cats, cat_groups, geo, degrees, jobs, people
+            (:obj:`pandas.DataFrame`): Tables returned by read_data.
+        org_ids (:obj:`iterable` of :obj:`str`): Organisation IDs to keep.
+        cache_dir (:obj:`str` | :obj:`NoneType`): Cache of the ethnicity
+            predictions. Defaults to None.
+        n_jobs (:obj:`int`): Number of processes predicting ethnicities.
+
+    Return:
+        (:obj:`dict` of :obj:`pandas.DataFrame`): Table names mapped to
+            their contents.
+
+    """
+    orgs = orgs[orgs.id.isin(org_ids)].merge(geo, how='left',
+                                             left_on='location_id',
+                                             right_on='id')
+    orgs = orgs.rename(columns={'id_x': 'org_id'})[tables['orgs']]
+    orgs = orgs.assign(
+        employee_count=normalise_company_sizes(orgs.employee_count))
+
+    jobs = jobs[jobs.org_id.isin(orgs.org_id)][tables['jobs']]
+    # People missing from the people table have no person_id in merge_tables
+    jobs = jobs.assign(
+        person_id=jobs.person_id.where(jobs.person_id.isin(people.id)))
+
+    categories = cats[cats.organization_id.isin(orgs.org_id)] \
+        .merge(cat_groups, on='category_name') \
+        .rename(columns={'organization_id': 'org_id'})
+    categories = categories[tables['org_categories']]
+
+    people = people[people.id.isin(jobs.person_id)] \
+        .rename(columns={'id': 'person_id'})
+    with profiling.stage('predict_ethnicity', people) as stage:
+        people = predict_ethnicity(people, cache_dir=cache_dir,
+                                   n_jobs=n_jobs)[tables['people']]
+        stage.output(people)
+
+    degrees = degrees[degrees.person_id.isin(people.person_id)][
+        tables['degrees']]
+    degrees = degrees.assign(
+        degree_type=normalise_degree_types(degrees.degree_type))
+
+    return {'orgs': orgs, 'jobs': jobs, 'org_categories': categories,
+            'people': people, 'degrees': degrees}
+
+
+def write_tables(dfs, directory):
+    """Write normalised tables as compressed Parquet files with
+    dictionary-encoded categorical columns.
+
+    Args:
+        dfs (:obj:`dict` of :obj:`pandas.DataFrame`): Table names mapped to
+            their contents.
+        directory (:obj:`str`): Output directory, one file per table.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, df in dfs.items():
+        df = df.reset_index(drop=True)
+        for col in set(categoricals) & set(df.columns):
+            df[col] = df[col].astype('category')
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                       os.path.join(directory, '{}.parquet'.format(name)),
+                       compression='snappy')
+
 
-    ojpd.degree_type = ojpd.degree_type.apply(change_degree_type)
-    ojpd.employee_count = ojpd.employee_count.apply(company_size)
+def read_batch(con, org_ids, tables=TABLES):
+    """Read the rows of a batch of organisations: the organisations, their
+    categories and jobs and the people and degrees of the jobs.
 
-    ojpd.to_csv('../data/processed/ojpd_eu_v3.csv', index=False)
+    Args:
+        con (:obj:`sqlalchemy.engine.Engine`): Database engine.
+        org_ids (:obj:`list` of :obj:`str`): Organisation IDs.
+        tables (:obj:`dict`): Table names mapped to the columns to select.
+
+    Return:
+        (:obj:`dict` of :obj:`pandas.DataFrame`): Rows of the tables of
+            BATCH_FILTERS.
+
+    """
+    return {table: read_table(con, table, tables[table], where=where,
+                              params={'org_ids': list(org_ids)})
+            for table, where in BATCH_FILTERS.items()}
+
+
+def stream_data(config_file, org_ids, path, batch_size=STREAM_BATCH_SIZE,
+                cache_dir=None, n_jobs=1):
+    """Build the processed dataset in batches of organisations and append
+    every batch to a CSV. Only the location and category group tables are
+    kept in memory; the rows of a batch are read from the database, merged,
+    normalised and written before the next batch, so memory use depends on
+    the batch size rather than on the size of the data.
+
+    Args:
+        config_file (:obj:`str`): Path to the database config file.
+        org_ids (:obj:`iterable` of :obj:`str`): Organisation IDs to keep.
+        path (:obj:`str`): Output CSV.
+        batch_size (:obj:`int`): Organisations per batch.
+        cache_dir (:obj:`str` | :obj:`NoneType`): Cache of the ethnicity
+            predictions. Defaults to None.
+        n_jobs (:obj:`int`): Number of processes predicting ethnicities.
+
+    Return:
+        (:obj:`tuple`): Shape of the processed dataset.
+
+    """
+    con = get_engine(config_file)
+    geo = read_table(con, 'geographic_data', TABLES['geographic_data'])
+    cat_groups = read_table(con, 'crunchbase_category_groups',
+                            TABLES['crunchbase_category_groups'])
+    org_ids = sorted(set(org_ids))
+    # Names recur across batches; predict each once and save the cache once.
+    races = NameRaces(cache_dir)
+    n_rows = n_cols = 0
+    for start in range(0, len(org_ids), batch_size):
+        batch = org_ids[start:start + batch_size]
+        with profiling.stage('batch_{}'.format(start // batch_size),
+                             batch) as stage:
+            dfs = read_batch(con, batch)
+            ojpd = merge_tables(dfs['crunchbase_organizations'],
+                                dfs['crunchbase_organizations_categories'],
+                                cat_groups, geo, dfs['crunchbase_degrees'],
+                                dfs['crunchbase_jobs'],
+                                dfs['crunchbase_people'], org_ids=batch,
+                                n_jobs=n_jobs, races=races)
+            ojpd.degree_type = normalise_degree_types(ojpd.degree_type)
+            ojpd.employee_count = normalise_company_sizes(
+                ojpd.employee_count)
+            ojpd.to_csv(path, mode='a' if start else 'w', header=not start,
+                        index=False)
+            stage.output(ojpd)
+        n_rows, n_cols = n_rows + ojpd.shape[0], ojpd.shape[1]
+    races.save()
+    con.dispose()
+    return n_rows, n_cols
+
+
+def write_data(ojpd, path):
+    """Normalise the degree types and company sizes of the processed dataset
+    and write it to a CSV.
+
+    Args:
+        ojpd (:obj:`pandas.DataFrame`): Processed dataset. It is modified.
+        path (:obj:`str`): Output CSV.
+
+    Return:
+        (:obj:`pandas.DataFrame`): The normalised dataset.
+
+    """
+    with profiling.stage('normalise_degree_types', ojpd) as stage:
+        ojpd.degree_type = stage.output(
+            normalise_degree_types(ojpd.degree_type))
+    with profiling.stage('normalise_company_sizes', ojpd) as stage:
+        ojpd.employee_count = stage.output(
+            normalise_company_sizes(ojpd.employee_count))
+
+    with profiling.stage('write_csv', ojpd):
+        ojpd.to_csv(path, index=False)
+    return ojpd
+
+
+def process_data(dfs, org_ids, path, cache_dir=None, n_jobs=1):
+    """Merge the tables read by read_data into the processed dataset and
+    write it, see write_data.
+
+    Args:
+        dfs (:obj:`tuple` of :obj:`pandas.DataFrame`): Output of read_data.
+        org_ids (:obj:`iterable` of :obj:`str`): Organisation IDs to keep.
+        path (:obj:`str`): Output CSV.
+        cache_dir (:obj:`str` | :obj:`NoneType`): Cache of the ethnicity
+            predictions. Defaults to None.
+        n_jobs (:obj:`int`): Number of processes predicting ethnicities.
+
+    Return:
+        (:obj:`pandas.DataFrame`)
+
+    """
+    with profiling.stage('merge_tables', dfs[0]) as stage:
+        ojpd = merge_tables(*dfs, org_ids=org_ids, cache_dir=cache_dir,
+                            n_jobs=n_jobs)
+        stage.output(ojpd)
+    return write_data(ojpd, path)
+
+
+def prepare_data(pushdown=False, cache_dir=None, offline=False, n_jobs=1,
+                 normalised=False, batch_size=None):
+    """Build the processed dataset of organisations, jobs, people and
+    degrees.
+
+    Args:
+        pushdown (:obj:`bool`): If True, the organisation filter and the
+            merges run in the database and only the selected organisations
+            are read. Defaults to False.
+        cache_dir (:obj:`str` | :obj:`NoneType`): If given, the tables and
+            the ethnicity predictions are read through a local cache in this
+            directory. Tables are not cached with pushdown. Defaults to None.
+        offline (:obj:`bool`): If True, the tables are loaded from cache_dir
+            without connecting to the database. Defaults to False.
+        n_jobs (:obj:`int`): Number of processes predicting ethnicities.
+            Defaults to 1.
+        normalised (:obj:`bool`): If True, the dataset is written as
+            normalised Parquet tables instead of one CSV. Cannot be used with
+            pushdown. Defaults to False.
+        batch_size (:obj:`int` | :obj:`NoneType`): If given, the dataset is
+            streamed to the CSV in batches of this many organisations, see
+            stream_data. Cannot be used with pushdown, offline or normalised.
+            Defaults to None.
+
+    """
+    with open(sys.argv[2], 'rb') as h:
+        org_ids = pickle.load(h)
+
+    if batch_size:
+        if pushdown or offline or normalised:
+            raise ValueError('Streaming reads every batch from the database '
+                             'and writes one CSV.')
+        print(stream_data(sys.argv[1], org_ids,
+                          '../data/processed/ojpd_eu_v3.csv', batch_size,
+                          cache_dir=cache_dir, n_jobs=n_jobs))
+        return
+
+    if normalised:
+        if pushdown:
+            raise ValueError('The normalised output is built in memory and '
+                             'cannot be combined with pushdown.')
+        dfs = build_tables(*read_data(sys.argv[1], cache_dir=cache_dir,
+                                      offline=offline),
+                           org_ids=org_ids, cache_dir=cache_dir,
+                           n_jobs=n_jobs)
+        with profiling.stage('write_tables'):
+            write_tables(dfs, '../data/processed/ojpd_eu_v3')
+        print({name: df.shape for name, df in dfs.items()})
+        return
+
+    if pushdown:
+        with profiling.stage('read_subset') as stage:
+            ojpd = stage.output(read_subset(sys.argv[1], org_ids))
+        with profiling.stage('predict_ethnicity', ojpd) as stage:
+            ojpd = predict_ethnicity(ojpd, cache_dir=cache_dir,
+                                     n_jobs=n_jobs)[OUTPUT_COLUMNS]
+            stage.output(ojpd)
+        ojpd = write_data(ojpd, '../data/processed/ojpd_eu_v3.csv')
+    else:
+        ojpd = process_data(read_data(sys.argv[1], cache_dir=cache_dir,
+                                      offline=offline),
+                            org_ids, '../data/processed/ojpd_eu_v3.csv',
+                            cache_dir=cache_dir, n_jobs=n_jobs)
     print(ojpd.shape)
 
 
 if __name__ == '__main__':
-    prepare_data()
+    offline = '--offline' in sys.argv
+    if '--profile' in sys.argv:
+        profiling.enable()
+    prepare_data(pushdown='--pushdown' in sys.argv,
+                 cache_dir=CACHE_DIR if offline or '--cache' in sys.argv
+                 else None,
+                 offline=offline,
+                 normalised='--normalised' in sys.argv,
+                 batch_size=STREAM_BATCH_SIZE if '--stream' in sys.argv
+                 else None)
+    if '--profile' in sys.argv:
+        profiling.write_report(profiling.disable(), PROFILE_REPORT)
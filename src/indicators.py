@@ -1,6 +1,391 @@
+import os
 import sys
+import json
+import pickle
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-from skbio.diversity.alpha import simpson
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import profiling
+from lists import tables, categoricals
+
+# Types of the columns of the processed dataset. Other columns are strings.
+DTYPES = dict({col: 'category' for col in categoricals},
+              funding_total_usd=float, latitude=float, longitude=float,
+              is_current=float)
+
+# Identifiers, dictionary-encoded by compact. Organisations and institutions
+# share their codes so that they can be joined.
+ID_COLUMNS = ['org_id', 'institution_id', 'job_id', 'person_id', 'degree_id']
+# Columns that compact stores as 32 bit floats.
+FLOAT32_COLUMNS = ['latitude', 'longitude']
+
+# Rows per row group of the Parquet copy of the processed CSV, the largest
+# block that iter_chunks reads at once.
+ROW_GROUP_SIZE = 100000
+
+RESULTS_CACHE_DIR = '../data/interim/indicators_cache'
+# Stage timings and memory written by the --profile flag.
+PROFILE_REPORT = '../data/interim/indicators_profile.json'
+
+# Dimensions of the count cubes of Indicators.
+CUBE_DIMENSIONS = ['country', 'city', 'gender', 'race', 'degree_type',
+                   'job_type', 'category_group_list', 'employee_count']
+
+# Columns used by the Indicators methods.
+COLUMNS = ['org_id', 'city', 'country', 'employee_count', 'primary_role',
+           'is_current', 'job_type', 'category_group_list', 'person_id',
+           'gender', 'race', 'degree_type', 'institution_id']
+
+
+def load_tables(directory, columns=None):
+    """Load the normalised tables written by data.write_tables and join them
+    into the layout of the processed CSV. Only the requested columns are
+    read. The categories and the degrees are always joined, as they multiply
+    the rows that the row counts of the indicators are computed on; the
+    people table, one row per person, is only joined if it holds a requested
+    column.
+
+    Args:
+        directory (:obj:`str`): Directory of the Parquet tables.
+        columns (:obj:`list` of :obj:`str` | :obj:`NoneType`): Columns to
+            load. Defaults to all of them.
+
+    Return:
+        (:obj:`pandas.DataFrame`)
+
+    """
+    wanted = set(columns) if columns is not None \
+        else {col for cols in tables.values() for col in cols}
+
+    def read(name, keys):
+        return pq.read_table(os.path.join(directory,
+                                          '{}.parquet'.format(name)),
+                             columns=[col for col in tables[name]
+                                      if col in wanted | keys]).to_pandas()
+
+    df = read('orgs', {'org_id'}).merge(read('jobs', {'org_id', 'person_id'}),
+                                        how='left', on='org_id')
+    for name, key in [('org_categories', 'org_id'), ('people', 'person_id'),
+                      ('degrees', 'person_id')]:
+        if name != 'people' or wanted & set(tables[name]) - {key}:
+            df = df.merge(read(name, {key}), how='left', on=key)
+    return df[[col for col in df.columns if col in wanted]]
+
+
+def read_processed(path, columns=None):
+    """Read the processed dataset with typed and categorical columns. A CSV
+    is parsed once and a Parquet copy is written next to it, atomically,
+    which is read instead for as long as it is newer than the CSV.
+
+    Args:
+        path (:obj:`str`): A CSV, Parquet or Arrow file, or a directory of
+            normalised tables.
+        columns (:obj:`list` of :obj:`str` | :obj:`NoneType`): Columns to
+            read. Defaults to all of them.
+
+    Return:
+        (:obj:`pandas.DataFrame`)
+
+    """
+    if os.path.isdir(path):
+        return load_tables(path, columns)
+
+    if path.endswith('.csv'):
+        parquet_path = path + '.parquet'
+        if not os.path.exists(parquet_path) or \
+                os.path.getmtime(parquet_path) < os.path.getmtime(path):
+            df = pd.read_csv(path, dtype={col: DTYPES.get(col, object)
+                                          for col in pd.read_csv(
+                                              path, nrows=0).columns})
+            # Written aside and renamed, so that a crash or another process
+            # never leaves a partial copy that is newer than the CSV
+            tmp_path = '{}.{}.tmp'.format(parquet_path, os.getpid())
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                           tmp_path, compression='snappy',
+                           row_group_size=ROW_GROUP_SIZE)
+            os.replace(tmp_path, parquet_path)
+            return df if columns is None else df[columns]
+        path = parquet_path
+
+    if path.endswith('.parquet'):
+        return pq.read_table(path, columns=columns,
+                             memory_map=True).to_pandas()
+    arrow_table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    df = arrow_table.to_pandas()
+    return df if columns is None else df[columns]
+
+
+def compact(df):
+    """Shrink the processed dataset in memory. String columns are stored as
+    categoricals, so every row holds an integer code instead of a string;
+    coordinates are downcast to 32 bit floats and is_current to booleans,
+    rows without a job being False. category_group_list keeps one code per
+    combination of groups, see category_groups to split them. Indicators
+    give the same results on the compact DataFrame.
+
+    Args:
+        df (:obj:`pandas.DataFrame`)
+
+    Return:
+        (:obj:`pandas.DataFrame`)
+
+    """
+    df = df.copy()
+    for col in set(categoricals) & set(df.columns):
+        df[col] = df[col].astype('category')
+
+    org_columns = [col for col in ['org_id', 'institution_id']
+                   if col in df.columns]
+    orgs = pd.unique(np.concatenate([np.asarray(df[col].dropna(),
+                                                dtype=object)
+                                     for col in org_columns] or [[]]))
+    for col in ID_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.Categorical(
+                df[col], categories=orgs if col in org_columns else None)
+
+    for col in set(FLOAT32_COLUMNS) & set(df.columns):
+        df[col] = df[col].astype(np.float32)
+    if 'is_current' in df.columns:
+        df['is_current'] = df.is_current.eq(1)
+    return df
+
+
+def category_groups(combinations):
+    """Split combinations of category groups, the values of
+    category_group_list, into their groups. This is the indexed form of a
+    multi-hot encoding of the column: a row holds the code of its
+    combination and the combinations map to their groups.
+
+    Args:
+        combinations (:obj:`iterable` of :obj:`str`): Comma separated groups.
+
+    Return:
+        (:obj:`pandas.DataFrame`): One row per combination and group in it,
+            in the category_group_list and category_group columns.
+
+    """
+    combinations = pd.Series(pd.unique(np.asarray(combinations, dtype=object)),
+                             dtype=object).dropna()
+    groups = combinations.str.split(',')
+    return pd.DataFrame({
+        'category_group_list': np.repeat(combinations.values,
+                                         groups.str.len().values),
+        'category_group': np.concatenate(list(groups.values) or [[]])},
+        columns=['category_group_list', 'category_group'])
+
+
+def location_columns(location):
+    """(:obj:`list` of :obj:`str`): Columns that identify a location. Cities
+    are identified with their country, as city names are not unique."""
+    return ['country', 'city'] if location == 'city' else [location]
+
+
+def count_studies(df, location, local_orgs):
+    """Count the people in every location and those who studied in an
+    organisation of the same location.
+
+    Args:
+        df (:obj:`pandas.DataFrame`)
+        location (:obj:`str`): 'country' or 'city'.
+        local_orgs (:obj:`pandas.DataFrame`): Location and org_id pairs, see
+            location_columns.
+
+    Return:
+        (:obj:`pandas.DataFrame`): The local and all columns hold the number
+            of unique person_id per location, indexed by its
+            location_columns.
+
+    """
+    keys = location_columns(location)
+    df = df[keys + ['person_id', 'institution_id']].dropna(subset=keys)
+    local = df.dropna(subset=['institution_id']) \
+              .merge(local_orgs.rename(columns={'org_id': 'institution_id'}),
+                     on=keys + ['institution_id']) \
+              .groupby(keys, observed=True)['person_id'].nunique()
+    people = df.groupby(keys, observed=True)['person_id'] \
+               .nunique(dropna=False)
+    return pd.DataFrame({'local': local.reindex(people.index, fill_value=0),
+                         'all': people})
+
+
+def multinomial(counts, n_boot, rng):
+    """Resample count vectors: draw multinomial replicates of every row with
+    the total and the proportions of the row. The draws are chained binomial
+    draws, one per column, vectorised over the rows and the replicates.
+
+    Args:
+        counts (:obj:`numpy.ndarray`): Counts, one row per location.
+        n_boot (:obj:`int`): Number of replicates.
+        rng (:obj:`numpy.random.RandomState`)
+
+    Return:
+        (:obj:`numpy.ndarray`): Replicates, of shape (n_boot,) + counts.shape.
+
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    draws = np.zeros((n_boot,) + counts.shape, dtype=np.int64)
+    # Empty columns are never drawn
+    columns = np.flatnonzero(counts.any(axis=0))
+    if not columns.size:
+        return draws
+    left = np.repeat(counts.sum(axis=1)[np.newaxis], n_boot, axis=0)
+    mass = counts.sum(axis=1).astype(float)
+    for k in columns[:-1]:
+        p = np.divide(counts[:, k], mass, out=np.zeros(mass.shape),
+                      where=mass > 0)
+        draws[:, :, k] = rng.binomial(left, np.minimum(p, 1))
+        left -= draws[:, :, k]
+        mass -= counts[:, k]
+    draws[:, :, columns[-1]] = left
+    return draws
+
+
+def confidence_intervals(estimates, replicates, index, alpha):
+    """Percentile bootstrap intervals.
+
+    Args:
+        estimates (:obj:`numpy.ndarray`): Point estimates.
+        replicates (:obj:`numpy.ndarray`): Estimates of the replicates, along
+            the first axis.
+        index (:obj:`pandas.Index`): Labels of the estimates.
+        alpha (:obj:`float`): The intervals cover 1 - alpha.
+
+    Return:
+        (:obj:`pandas.DataFrame`): The estimate, lower and upper columns.
+
+    """
+    lower, upper = np.percentile(replicates, [50 * alpha, 100 - 50 * alpha],
+                                 axis=0)
+    return pd.DataFrame({'estimate': estimates, 'lower': lower,
+                         'upper': upper}, index=index,
+                        columns=['estimate', 'lower', 'upper'])
+
+
+class CountCube():
+    """Number of rows of a DataFrame in every observed combination of some
+    dimensions. Counts are additive, so the counts of any subset of the
+    dimensions are found by summing cells rather than rescanning the data.
+
+    Args:
+        data (:obj:`pandas.DataFrame`)
+        dims (:obj:`list` of :obj:`str`): Dimension columns.
+        weights (:obj:`str` | :obj:`NoneType`): If given, the values of this
+            column are summed instead of counting rows. Defaults to None.
+
+    """
+    def __init__(self, data, dims, weights=None):
+        self.dims = list(dims)
+        self.levels = {}
+        codes = {}
+        for dim in self.dims:
+            # Sorted codes give sorted labels; missing values are coded -1.
+            codes[dim], uniques = pd.factorize(data[dim], sort=True)
+            self.levels[dim] = np.asarray(uniques, dtype=object)
+        codes = pd.DataFrame(codes, columns=self.dims)
+        if weights is None:
+            grouped = codes.groupby(self.dims).size()
+        else:
+            codes['count'] = np.asarray(data[weights])
+            grouped = codes.groupby(self.dims)['count'].sum()
+        self.cells = grouped.reset_index(name='count')
+
+    @classmethod
+    def combine(cls, cubes):
+        """Add up cubes with the same dimensions built on disjoint rows.
+        Negative counts retract rows; cells left empty are dropped.
+
+        Args:
+            cubes (:obj:`list` of :obj:`CountCube`)
+
+        Return:
+            (:obj:`CountCube`)
+
+        """
+        cells = pd.concat([cube.labelled_cells() for cube in cubes],
+                          ignore_index=True)
+        cube = cls(cells, cubes[0].dims, weights='count')
+        cube.cells = cube.cells[cube.cells['count'] != 0]
+        return cube
+
+    def labelled_cells(self):
+        """(:obj:`pandas.DataFrame`): The cells with labels instead of
+        codes."""
+        cells = {dim: np.append(self.levels[dim], np.nan)[self.cells[dim]]
+                 for dim in self.dims}
+        cells['count'] = self.cells['count'].values
+        return pd.DataFrame(cells, columns=self.dims + ['count'])
+
+    def _cells(self, where=None):
+        """(:obj:`pandas.DataFrame`): Cells whose labels are in where."""
+        cells = self.cells
+        for dim, values in (where or {}).items():
+            kept = np.flatnonzero(pd.Index(self.levels[dim]).isin(values))
+            cells = cells[cells[dim].isin(kept)]
+        return cells
+
+    def joint_counts(self, row, cols, where=None):
+        """Cross a dimension with every combination of other dimensions. A
+        missing value of the latter is counted as a value of its own, so the
+        counts of a row add up to all the rows of its label.
+
+        Args:
+            row (:obj:`str`): Dimension of the rows. Missing values are
+                dropped.
+            cols (:obj:`list` of :obj:`str`): Dimensions of the columns.
+            where (:obj:`dict` | :obj:`NoneType`): Dimensions mapped to the
+                values to keep. Defaults to None.
+
+        Return:
+            (:obj:`pandas.Index`, :obj:`pandas.DataFrame`,
+                :obj:`numpy.ndarray`): The labels of the rows, the codes of
+                the cols in every column (-1 if missing) and the counts.
+
+        """
+        cells = self._cells(where)
+        cells = cells[cells[row] >= 0]
+        combos = cells.groupby(cols).ngroup().values
+        rows, codes = pd.factorize(cells[row], sort=True)
+        counts = np.zeros((len(codes), combos.max() + 1 if len(combos) else 0),
+                          dtype=np.int64)
+        np.add.at(counts, (rows, combos), cells['count'].values)
+        return (pd.Index(self.levels[row][codes], name=row),
+                cells[cols].groupby(combos).first().reset_index(drop=True),
+                counts)
+
+    def count(self, *dims, where=None):
+        """Roll the cube up to some dimensions.
+
+        Args:
+            *dims: Dimensions to group by.
+            where (:obj:`dict` | :obj:`NoneType`): Dimensions mapped to the
+                values to keep. Defaults to None.
+
+        Return:
+            (:obj:`pandas.Series`): The same as grouping the data by dims and
+                counting the rows.
+
+        """
+        cells = self._cells(where)
+        # groupby drops rows with a missing key
+        cells = cells[(cells[list(dims)] >= 0).all(axis=1)]
+        grouped = cells.groupby(list(dims))['count'].sum()
+        if len(dims) == 1:
+            index = pd.Index(self.levels[dims[0]][grouped.index.values],
+                             name=dims[0])
+        else:
+            index = pd.MultiIndex.from_arrays(
+                [self.levels[dim][grouped.index.get_level_values(dim)]
+                 for dim in dims], names=dims)
+        return pd.Series(grouped.values, index=index, name='person_id')
 
 
 class Indicators():
@@ -8,6 +393,139 @@ class Indicators():
     def __init__(self, data):
         self.data = data
         self.groupsum = lambda x: x / x.sum()
+        # Views of the data built on first use. self.data should not be
+        # modified after they are built.
+        self._views = {}
+
+    def _view(self, key, build):
+        """Build a view of the data once and cache it.
+
+        Args:
+            key (:obj:`hashable`): Name of the view.
+            build (:obj:`function`): Returns the view.
+
+        """
+        if key not in self._views:
+            name = key if isinstance(key, str) else '_'.join(map(str, key))
+            with profiling.stage('view_' + name, self.data) as stage:
+                self._views[key] = stage.output(build())
+        return self._views[key]
+
+    @property
+    def employees(self):
+        """(:obj:`pandas.DataFrame`): Rows of people currently working in a
+        company."""
+        return self._view('employees', lambda: self.data[
+            (self.data.is_current == 1)
+            & (self.data.primary_role == 'company')]
+            .dropna(subset=['person_id']))
+
+    @property
+    def unique_employees(self):
+        """(:obj:`pandas.DataFrame`): One row per person currently working in
+        a company."""
+        return self._view('unique_employees', lambda: self.employees
+                          .drop_duplicates('person_id'))
+
+    @property
+    def company_people(self):
+        """(:obj:`pandas.DataFrame`): One row per man or woman and company
+        they have worked in."""
+        return self._view('company_people', lambda: self.data[
+            (self.data.primary_role == 'company')
+            & (self.data.gender.isin(['male', 'female']))]
+            .drop_duplicates(['org_id', 'person_id']))
+
+    @property
+    def cube(self):
+        """(:obj:`CountCube`): Rows of current company employees."""
+        return self._view('cube', lambda: CountCube(
+            self.employees, [dim for dim in CUBE_DIMENSIONS
+                             if dim in self.data.columns]))
+
+    @property
+    def company_cube(self):
+        """(:obj:`CountCube`): Men and women, once per company."""
+        return self._view('company_cube', lambda: CountCube(
+            self.company_people, [dim for dim in CUBE_DIMENSIONS
+                                  if dim in self.data.columns]))
+
+    @property
+    def person_cube(self):
+        """(:obj:`CountCube`): Unique current company employees."""
+        return self._view('person_cube', lambda: CountCube(
+            self.unique_employees, [dim for dim in CUBE_DIMENSIONS
+                                    if dim in self.data.columns]))
+
+    def counts(self, *args, where=None, unique=False):
+        """Count the current company employees in every combination of the
+        args. Breakdowns over the cube dimensions are rolled up from the
+        cube; other ones are grouped from the data.
+
+        Args:
+            *args: Columns to group by.
+            where (:obj:`dict` | :obj:`NoneType`): Columns mapped to the values
+                to keep. Defaults to None.
+            unique (:obj:`bool`): If True, every person is counted once,
+                otherwise every row is. Defaults to False.
+
+        Return:
+            (:obj:`pandas.Series`): Counts of person_id.
+
+        """
+        cube = self.person_cube if unique else self.cube
+        if set(args) | set(where or {}) <= set(cube.dims):
+            return cube.count(*args, where=where)
+        df = self.unique_employees if unique else self.employees
+        for col, values in (where or {}).items():
+            df = df[df[col].isin(values)]
+        return df.groupby(list(args), observed=True)['person_id'].count()
+
+    def population(self, location='country', country=None):
+        """Count the people currently working in every location.
+
+        Args:
+            location (:obj:`str`): Location column, e.g. 'country' or 'city'.
+            country (:obj:`str` | :obj:`NoneType`): If given, only the
+                locations of this country are counted. Defaults to None.
+
+        Return:
+            (:obj:`pandas.Series`): Number of unique person_id per location.
+
+        """
+        def build():
+            df = self.unique_employees
+            if country:
+                df = df[df.country == country]
+            return df.groupby(location, observed=True).count()['person_id']
+        return self._view(('population', location, country), build)
+
+    def category_group_counts(self, *args, where=None, unique=False):
+        """Count like counts, with every group of category_group_list
+        counted on its own rather than their combinations. The counts of
+        the combinations are split with category_groups, so no row is
+        duplicated.
+
+        Args:
+            *args: Columns to group by, including category_group_list. It is
+                replaced by category_group in the output.
+            where (:obj:`dict` | :obj:`NoneType`): Columns mapped to the values
+                to keep. Defaults to None.
+            unique (:obj:`bool`): If True, every person is counted once,
+                otherwise every row is. Defaults to False.
+
+        Return:
+            (:obj:`pandas.Series`): Counts of person_id.
+
+        """
+        counts = self.counts(*args, where=where, unique=unique).reset_index()
+        counts['category_group_list'] = counts.category_group_list \
+                                              .astype(object)
+        counts = counts.merge(category_groups(counts.category_group_list),
+                              on='category_group_list')
+        keys = ['category_group' if arg == 'category_group_list' else arg
+                for arg in args]
+        return counts.groupby(keys, observed=True)['person_id'].sum()
 
     def degree_diversity(self, *args, city_level=False, country=None,
                          thresh=25):
@@ -29,21 +547,16 @@ class Indicators():
                 values are proportions.
 
         """
-        df = self.data.dropna(subset=['person_id'])
-        df = df[(df.is_current == 1) & (df.primary_role == 'company')]
-        df = df[df.degree_type.isin(['MBA', 'PhD', 'Postgraduate',
-                                     'Undergraduate'])]
+        where = {'degree_type': ['MBA', 'PhD', 'Postgraduate',
+                                 'Undergraduate']}
         if city_level:
-            df = df[df.country == country]
+            where['country'] = [country]
             idx = self.reindexing(thresh, location='city', country=country)
-            return df.groupby(list(args))['person_id'] \
-                     .count().groupby(level=[args[0], args[-1]]) \
-                     .transform(self.groupsum).reindex(idx, level=0) * 100
         else:
             idx = self.reindexing(thresh, location='country')
-            return df.groupby(list(args))['person_id'] \
-                     .count().groupby(level=[args[0], args[-1]]) \
-                     .transform(self.groupsum).reindex(idx, level=0) * 100
+        return self.counts(*args, where=where) \
+                   .groupby(level=[args[0], args[-1]], observed=True) \
+                   .transform(self.groupsum).reindex(idx, level=0) * 100
 
     def people_diversity(self, *args, thresh=25):
         """Find the gender / ethnic diversity of the people that are currently
@@ -62,11 +575,8 @@ class Indicators():
                 values are proportions.
 
         """
-        df = self.data[(self.data.is_current == 1)
-                       & (self.data.primary_role == 'company')] \
-                 .drop_duplicates('person_id')
-        nominator = df.groupby(list(args)).count()['person_id']
-        denominator = df.groupby(args[0]).count()['person_id']
+        nominator = self.counts(*args, unique=True)
+        denominator = self.population(args[0])
         if args[0] == 'country':
             idx = self.reindexing(thresh, location='country')
         else:
@@ -90,12 +600,7 @@ class Indicators():
                 their populations (descending order).
 
         """
-        df = self.data[(self.data.is_current == 1)
-                       & (self.data.primary_role == 'company')] \
-                 .drop_duplicates('person_id')
-        if country:
-            df = df[df.country == country]
-        grouped = df.groupby(location).count()['person_id']
+        grouped = self.population(location, country)
         return grouped.where(grouped > thresh) \
                       .dropna().sort_values(ascending=False).index
 
@@ -111,16 +616,63 @@ class Indicators():
             (:obj:`pandas.DataFrame`): A DataFrame grouped by the args.
 
         """
-        df = self.data.dropna(subset=['person_id'])
-        df = df[(df.is_current == 1) & (df.primary_role == 'company')]
         if len(args) > 2:
-            return df.groupby(list(args))['person_id'] \
-                     .count().groupby(level=[args[0], args[-1]]) \
-                     .transform(self.groupsum) * 100
+            return self.counts(*args) \
+                       .groupby(level=[args[0], args[-1]], observed=True) \
+                       .transform(self.groupsum) * 100
         else:
-            return df.groupby(list(args))['person_id'] \
-                     .count().groupby(level=[args[0]]) \
-                     .transform(self.groupsum) * 100
+            return self.counts(*args) \
+                       .groupby(level=[args[0]], observed=True) \
+                       .transform(self.groupsum) * 100
+
+    def study_counts(self, location='country'):
+        """Count the people in every location and those who studied in an
+        organisation of the same location, in one pass.
+
+        Args:
+            location (:obj:`str`): 'country' or 'city'.
+
+        Return:
+            (:obj:`pandas.DataFrame`): The local and all columns hold the
+                number of unique person_id per location, see
+                count_studies.
+
+        """
+        return self._view(('study_counts', location), lambda: count_studies(
+            self.data, location, self.local_orgs(location)))
+
+    def local_orgs(self, location='country'):
+        """Find the organisations of every location.
+
+        Args:
+            location (:obj:`str`): 'country' or 'city'.
+
+        Return:
+            (:obj:`pandas.DataFrame`): Unique location and org_id pairs, the
+                location in its location_columns.
+
+        """
+        keys = location_columns(location)
+        return self._view(('local_orgs', location), lambda: self.data[
+            keys + ['org_id']].dropna(subset=keys).drop_duplicates())
+
+    def home_studies(self, location='country', thresh=100):
+        """Find the proportion of people who studied at the same location of
+            their work, for every location.
+
+        Args:
+            location (:obj:`str`): 'country' or 'city'.
+            thresh (:obj:`int`): Locations with a count lower than the
+                threshold get 0.
+
+        Return:
+            (:obj:`dict`): Percentage of people per location. Cities are
+                keyed by (country, city).
+
+        """
+        counts = self.study_counts(location)
+        return (counts['local'] / counts['all'] * 100) \
+            .where(counts['all'] > thresh, 0).to_dict()
 
     def home_study(self, country, thresh=100):
         """Find the proportion of people who studied at the same location of
@@ -135,16 +687,80 @@ class Indicators():
             (:obj:`float`): Percentage of people.
 
         """
-        df = self.data[self.data.country == country]
-        local_uni = df[df.institution_id
-                         .isin(set(df.org_id))].person_id \
-                                               .unique().shape[0]
-
-        all_universities = df.person_id.unique().shape[0]
-        if all_universities > thresh:
-            return (local_uni / all_universities) * 100
-        else:
-            return 0
+        return self.home_studies('country', thresh).get(country, 0)
+
+    def company_counts(self, location, cols, country=None):
+        """Count the men and women of every location, once per company they
+        have worked in.
+
+        Args:
+            location (:obj:`str`): Location column, 'country' or 'city'.
+            cols (:obj:`list` of :obj:`str`): Columns with the categories.
+            country (:obj:`str` | :obj:`NoneType`): If given, only the rows of
+                this country are counted. Defaults to None.
+
+        Return:
+            (:obj:`pandas.Series`, :obj:`pandas.Series`, :obj:`dict` of
+                :obj:`pandas.Series`): The unique people and the rows of every
+                location and, for each column, the rows of every location and
+                category.
+
+        """
+        df = self.company_people
+        if country is not None:
+            df = df[df.country == country]
+        grouped = df.groupby(location, observed=True)
+        return (grouped['person_id'].nunique(dropna=False), grouped.size(),
+                {col: df.groupby([location, col], observed=True).size()
+                 for col in cols})
+
+    def location_shares(self, counts, thresh, locations=None):
+        """Find the share of every category in each location.
+
+        Args:
+            counts (:obj:`tuple`): Output of company_counts.
+            thresh (:obj:`int`): Keep locations with more unique people than
+                the threshold.
+            locations (:obj:`list` | :obj:`NoneType`): If given, only these
+                locations are kept. Defaults to None.
+
+        Return:
+            (:obj:`pandas.Index`, :obj:`dict` of :obj:`pandas.Series`): The
+                kept locations and, for each column, the number of rows per
+                location and category divided by the rows in the location.
+
+        """
+        people, sizes, counts = counts
+        keep = people.index[people > thresh]
+        if locations is not None:
+            keep = keep[keep.isin(locations)]
+
+        shares = {}
+        for col, col_counts in counts.items():
+            col_counts = col_counts[col_counts.index.get_level_values(0)
+                                              .isin(keep)]
+            shares[col] = col_counts / sizes.reindex(
+                col_counts.index.get_level_values(0)).values
+        return keep, shares
+
+    def lieberson_shares(self, cols, thresh, country_level=False,
+                         city_level=False, country=None):
+        """Category shares used by the Lieberson index. At city level, the
+        cities of the country are measured on all their rows, whatever the
+        country of the rows.
+
+        Return:
+            (:obj:`pandas.Index`, :obj:`dict` of :obj:`pandas.Series`): See
+                location_shares. None if neither level is selected.
+
+        """
+        if country_level:
+            return self.location_shares(self.company_counts('country', cols),
+                                        thresh)
+        if city_level and country is not None:
+            cities = self.company_counts('city', [], country=country)[0].index
+            return self.location_shares(self.company_counts('city', cols),
+                                        thresh, locations=cities)
 
     def lieberson_format(self, cols, thresh, country_level=False,
                          city_level=False, country=None):
@@ -162,34 +778,43 @@ class Indicators():
             (:obj:`dict` of :obj:`list`)
 
         """
-        df = self.data[(self.data.primary_role == 'company')
-                       & (self.data.gender.isin(['male', 'female']))] \
-                 .drop_duplicates(['org_id', 'person_id'])
-        if country_level:
-            dfs = [df[df.country == country]
-                   for country in df.country.unique()
-                   if df[df.country == country].person_id
-                                               .unique().shape[0] > thresh]
-            country_level_format = {}
-            for df in dfs:
-                d = {}
-                for col in cols:
-                    d[col] = list(df[col].value_counts() / df.shape[0])
-                country_level_format[df['country'].unique()[0]] = d
-            return country_level_format
+        result = self.lieberson_shares(cols, thresh, country_level,
+                                       city_level, country)
+        if result is None:
+            return None
+        keep, shares = result
+        formatted = {location: {col: [] for col in cols} for location in keep}
+        for col, values in shares.items():
+            for location, vals in values.groupby(level=0, observed=True):
+                formatted[location][col] = list(vals.sort_values(
+                    ascending=False))
+        return formatted
 
-        if city_level and country is not None:
-            dfs = [df[df.city == city]
-                   for city in df[df.country == country].city.unique()
-                   if df[df.city == city].person_id
-                                         .unique().shape[0] > thresh]
-            city_level_format = {}
-            for df in dfs:
-                d = {}
-                for col in cols:
-                    d[col] = list(df[col].value_counts() / df.shape[0])
-                city_level_format[df['city'].unique()[0]] = d
-            return city_level_format
+    def lieberson_indices(self, cols, thresh, country_level=False,
+                          city_level=False, country=None):
+        """Measure Lieberson's Aw (see lieberson_index) for every location at
+        once.
+
+        Args:
+            cols (:obj:`list` of :obj:`str`): The variables V.
+            thresh (:obj:`int`): Filter out locations with a count lower than
+                the threshold.
+            country_level (:obj:`bool`): If True, the output will be on country
+                level. Defaults to False.
+            city_level (:obj:`bool`): If True, the output will be on city
+                level. Defaults to False.
+            country (:obj:`str` | :obj:`NoneType`): Country name. Needed only
+                when city_level is True. Defaults to None.
+
+        Return:
+            (:obj:`dict`): Lieberson's Index of diversity per location.
+
+        """
+        keep, shares = self.lieberson_shares(cols, thresh, country_level,
+                                             city_level, country)
+        yk = sum((values ** 2).groupby(level=0, observed=True).sum()
+                 .reindex(keep, fill_value=0) for values in shares.values())
+        return (1 - yk / len(cols)).to_dict()
 
     def lieberson_index(self, d):
         """Measure Lieberson's Aw diversity within a population. Aw receives a
@@ -225,7 +850,8 @@ class Indicators():
         return aw
 
     def simpson_index(self, type, thresh, country=None, country_level=False):
-        """
+        """Measure the Simpson diversity of a column in every location, as
+        1 minus the sum of the squared proportions of its categories.
 
         Args:
             thresh (:obj:`int`): Filter out instances with a count lower than
@@ -239,84 +865,925 @@ class Indicators():
             (:obj:`dict`): Simpson diversity.
 
         """
-        df = self.data[(self.data.primary_role == 'company')
-                       & (self.data.gender.isin(['male', 'female']))] \
-                 .drop_duplicates(['org_id', 'person_id'])
+        if country_level:
+            people, _, counts = self.company_counts('country', [type])
+        else:
+            people, _, counts = self.company_counts('city', [type],
+                                                    country=country)
+        counts = counts[type]
+        keep = people.index[people > thresh]
+        freqs = counts / counts.groupby(level=0, observed=True) \
+                               .transform('sum')
+        # Locations whose values are all missing have no diversity, NaN
+        dominance = (freqs ** 2).groupby(level=0, observed=True).sum() \
+                                .reindex(keep)
+        return (1 - dominance).to_dict()
 
+    def simpson_bootstrap(self, type, thresh, country=None,
+                          country_level=False, n_boot=1000, alpha=0.05,
+                          seed=None):
+        """Bootstrap confidence intervals of simpson_index. The rows of
+        every location are resampled as multinomial draws on its category
+        counts.
+
+        Args:
+            n_boot (:obj:`int`): Number of replicates. Defaults to 1000.
+            alpha (:obj:`float`): The intervals cover 1 - alpha. Defaults to
+                0.05.
+            seed (:obj:`int` | :obj:`NoneType`): Seed of the replicates.
+            See simpson_index for the other args.
+
+        Return:
+            (:obj:`pandas.DataFrame`): The Simpson diversity and the bounds
+                of its interval per location.
+
+        """
         if country_level:
-            dfs = {country: df[df.country == country][type].value_counts()
-                   for country in df.country.unique()
-                   if df[df.country == country].person_id
-                                               .unique().shape[0] > thresh}
-            return {k: simpson(v) for k, v in dfs.items()}
+            people, _, counts = self.company_counts('country', [type])
         else:
-            df = df[df.country == country]
-            dfs = {city: df[df.city == city][type].value_counts()
-                   for city in df.city.unique()
-                   if df[df.city == city].person_id
-                                         .unique().shape[0] > thresh}
-            return {k: simpson(v) for k, v in dfs.items()}
+            people, _, counts = self.company_counts('city', [type],
+                                                    country=country)
+        keep = people.index[people > thresh]
+        counts = counts[type].unstack(fill_value=0) \
+                             .reindex(keep, fill_value=0).values
 
+        def simpson(draws):
+            totals = draws.sum(axis=-1, keepdims=True)
+            dominance = ((draws / np.maximum(totals, 1)) ** 2).sum(axis=-1)
+            # Locations whose values are all missing are NaN
+            return np.where(totals[..., 0] > 0, 1 - dominance, np.nan)
 
-def main():
-    data = pd.read_csv(sys.argv[1])
-    ind = Indicators(data)
+        rng = np.random.RandomState(seed)
+        return confidence_intervals(
+            simpson(counts), simpson(multinomial(counts, n_boot, rng)),
+            keep, alpha)
+
+    def lieberson_bootstrap(self, cols, thresh, country_level=False,
+                            city_level=False, country=None, n_boot=1000,
+                            alpha=0.05, seed=None):
+        """Bootstrap confidence intervals of lieberson_indices. The rows of
+        every location are resampled as multinomial draws on its counts of
+        every combination of the cols, so that the variables are resampled
+        together.
+
+        Args:
+            n_boot (:obj:`int`): Number of replicates. Defaults to 1000.
+            alpha (:obj:`float`): The intervals cover 1 - alpha. Defaults to
+                0.05.
+            seed (:obj:`int` | :obj:`NoneType`): Seed of the replicates.
+            See lieberson_indices for the other args.
+
+        Return:
+            (:obj:`pandas.DataFrame`): Lieberson's Aw and the bounds of its
+                interval per location. None if neither level is selected.
+
+        """
+        if country_level:
+            location = 'country'
+            keep = self.location_shares(
+                self.company_counts(location, []), thresh)[0]
+        elif city_level and country is not None:
+            location = 'city'
+            cities = self.company_counts(location, [], country=country)[0]
+            keep = self.location_shares(self.company_counts(location, []),
+                                        thresh, locations=cities.index)[0]
+        else:
+            return None
+
+        labels, codes, counts = self.company_cube.joint_counts(location, cols)
+        counts = counts[labels.get_indexer(keep)]
+        # Map the combinations of the cols to the categories of every col
+        onehots = [(codes[col].values[:, np.newaxis]
+                    == np.arange(codes[col].max() + 1)).astype(np.int64)
+                   for col in cols]
+
+        def aw(draws):
+            totals = np.maximum(draws.sum(axis=-1, keepdims=True), 1)
+            yk = sum((((draws @ onehot) / totals) ** 2).sum(axis=-1)
+                     for onehot in onehots)
+            return 1 - yk / len(cols)
+
+        rng = np.random.RandomState(seed)
+        return confidence_intervals(
+            aw(counts), aw(multinomial(counts, n_boot, rng)), keep, alpha)
+
+    def people_diversity_bootstrap(self, *args, thresh=25, n_boot=1000,
+                                   alpha=0.05, seed=None):
+        """Bootstrap confidence intervals of people_diversity. The people of
+        every location are resampled as multinomial draws on their counts in
+        every combination of the args, those with a missing value included.
+
+        Args:
+            n_boot (:obj:`int`): Number of replicates. Defaults to 1000.
+            alpha (:obj:`float`): The intervals cover 1 - alpha. Defaults to
+                0.05.
+            seed (:obj:`int` | :obj:`NoneType`): Seed of the replicates.
+            See people_diversity for the other args.
+
+        Return:
+            (:obj:`pandas.DataFrame`): The proportions and the bounds of
+                their intervals, indexed like people_diversity.
+
+        """
+        nominator = self.counts(*args, unique=True)
+        location = 'country' if args[0] == 'country' else 'city'
+        idx = self.reindexing(thresh, location=location)
+        table = nominator.unstack(list(range(1, len(args))), fill_value=0)
+        counts = table.reindex(idx, fill_value=0)
+        population = self.population(args[0]).reindex(idx).values
+        # The last column holds the people with a missing value
+        counts = np.column_stack([counts.values,
+                                  population - counts.values.sum(axis=1)])
+
+        def proportions(draws):
+            return draws[..., :-1] / population[:, np.newaxis] * 100
+
+        rng = np.random.RandomState(seed)
+        intervals = confidence_intervals(
+            proportions(counts).ravel(),
+            proportions(multinomial(counts, n_boot, rng))
+            .reshape(n_boot, -1), None, alpha)
+        index = nominator.reindex(idx, level=0).index
+        positions = idx.get_indexer(index.get_level_values(0)) \
+            * len(table.columns) + table.columns.get_indexer(
+                index.droplevel(0))
+        return intervals.iloc[positions].set_index(index)
+
+
+def read_columns(path):
+    """(:obj:`list` of :obj:`str`): Columns of a CSV or Parquet file."""
+    if path.endswith('.parquet'):
+        return pq.ParquetFile(path).schema.names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def count_rows(path):
+    """Count the rows of a Parquet file, or estimate those of a CSV from its
+    line breaks.
+
+    Args:
+        path (:obj:`str`): CSV or Parquet file.
+
+    Return:
+        (:obj:`int`)
+
+    """
+    if path.endswith('.parquet'):
+        return pq.ParquetFile(path).metadata.num_rows
+    with open(path, 'rb') as h:
+        return sum(block.count(b'\n')
+                   for block in iter(lambda: h.read(1 << 20), b'')) - 1
+
+
+def iter_chunks(path, columns, chunksize):
+    """Read the processed dataset in chunks of rows of a CSV or a Parquet
+    file. Row groups of a Parquet file are split into chunks, so no more
+    than a row group is held in memory while reading.
+
+    Args:
+        path (:obj:`str`): CSV or Parquet file.
+        columns (:obj:`list` of :obj:`str`): Columns to read.
+        chunksize (:obj:`int`): Rows per chunk.
+
+    """
+    if path.endswith('.csv'):
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize,
+                                 dtype={col: DTYPES.get(col, object)
+                                        for col in columns}):
+            yield chunk
+    elif path.endswith('.parquet'):
+        parquet_file = pq.ParquetFile(path)
+        for i in range(parquet_file.num_row_groups):
+            row_group = parquet_file.read_row_group(i, columns=columns)
+            for start in range(0, row_group.num_rows, chunksize):
+                yield row_group.slice(start, chunksize).to_pandas()
+    else:
+        raise ValueError('Only CSV and Parquet files can be read in chunks.')
+
+
+def add_counts(parts):
+    """Add up counts computed on disjoint parts of the data.
+
+    Args:
+        parts (:obj:`list` of :obj:`pandas.Series` | :obj:`pandas.DataFrame`)
+
+    Return:
+        (:obj:`pandas.Series` | :obj:`pandas.DataFrame`)
+
+    """
+    nonempty = [part for part in parts if len(part)]
+    if not nonempty:
+        return parts[0]
+    return pd.concat(nonempty).groupby(
+        level=list(range(nonempty[0].index.nlevels))).sum()
+
+
+def missing_people(df, keys):
+    """Find the locations with rows that have no person_id. Distinct counts
+    of person_id that keep missing values count these rows as one person.
+
+    Args:
+        df (:obj:`pandas.DataFrame`)
+        keys (:obj:`list` of :obj:`str`): Location columns.
+
+    Return:
+        (:obj:`pandas.Series`): 1 for every such location.
+
+    """
+    return df[df.person_id.isna()].dropna(subset=keys) \
+        .groupby(keys, observed=True).size().clip(upper=1)
+
+
+def dedupe_missing(counts, missing):
+    """Correct distinct counts of person_id added up over partitions. The
+    missing person_id is counted once in every partition holding rows of the
+    location without one, but it is one person in the data.
+
+    Args:
+        counts (:obj:`pandas.Series`): Counts added up by add_counts.
+        missing (:obj:`list` of :obj:`pandas.Series`): Output of
+            missing_people for every partition.
+
+    Return:
+        (:obj:`pandas.Series`)
+
+    """
+    repeats = add_counts(missing) - 1
+    return counts - repeats.reindex(counts.index, fill_value=0).values
+
+
+# Memory needed to process rows, relative to their size in a DataFrame.
+CHUNK_OVERHEAD = 4
+
+
+class ChunkedIndicators(Indicators):
+    """Indicators of a processed dataset that does not fit in memory.
+
+    The dataset is streamed in chunks and split on disk into partitions by
+    person_id, so that all the rows of a person are in the same partition,
+    in their original order. Rows without a person, e.g. organisations
+    without jobs, are split by org_id instead. Partitions are sized to fit
+    in memory_limit. Every aggregate used by Indicators is computed
+    partition by partition and added up: row counts are additive and people
+    are never split across partitions, so distinct counts are exact and the
+    results are the same as those of Indicators. The missing person, which
+    some distinct counts count as one, is deduplicated across partitions,
+    see dedupe_missing.
+
+    Args:
+        path (:obj:`str`): CSV or Parquet file of the processed dataset.
+        memory_limit (:obj:`int`): Bytes of data held in memory at once.
+            Defaults to 1 GB.
+        tmp_dir (:obj:`str` | :obj:`NoneType`): Directory of the partitions.
+            Defaults to a new temporary directory, removed by close.
+
+    """
+    def __init__(self, path, memory_limit=2**30, tmp_dir=None):
+        super().__init__(None)
+        self.columns = [col for col in COLUMNS if col in read_columns(path)]
+        sample = next(iter_chunks(path, self.columns, 10000))
+        row_bytes = CHUNK_OVERHEAD * sample.memory_usage(deep=True).sum() \
+            / max(sample.shape[0], 1)
+        chunksize = max(1000, int(memory_limit / row_bytes))
+        n_partitions = max(1, int(np.ceil(count_rows(path) * row_bytes
+                                          / memory_limit)))
+
+        self._tmp_dir = None if tmp_dir else tempfile.mkdtemp()
+        tmp_dir = tmp_dir or self._tmp_dir
+        self.partitions = [os.path.join(tmp_dir, 'partition_{}.parquet'
+                                                 .format(i))
+                           for i in range(n_partitions)]
+        schema = pa.schema([(col, pa.float64() if DTYPES.get(col) is float
+                             else pa.string()) for col in self.columns])
+        writers = [pq.ParquetWriter(partition, schema)
+                   for partition in self.partitions]
+        try:
+            for chunk in iter_chunks(path, self.columns, chunksize):
+                chunk = chunk.astype({col: object for col in chunk.columns
+                                      if DTYPES.get(col) == 'category'})
+                keys = pd.util.hash_pandas_object(
+                    chunk.person_id.fillna(chunk.org_id),
+                    index=False).values % n_partitions
+                for key, writer in enumerate(writers):
+                    part = chunk[keys == key]
+                    if part.shape[0]:
+                        writer.write_table(pa.Table.from_pandas(
+                            part, schema=schema, preserve_index=False))
+        finally:
+            for writer in writers:
+                writer.close()
+
+    def close(self):
+        """Remove the partitions if they are in a temporary directory."""
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir)
+            self._tmp_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def iter_partitions(self):
+        """Load the partitions one at a time.
+
+        Return:
+            (:obj:`generator` of :obj:`Indicators`)
+
+        """
+        for partition in self.partitions:
+            df = pq.read_table(partition).to_pandas()
+            yield Indicators(df.astype({col: 'category' for col in df.columns
+                                        if DTYPES.get(col) == 'category'}))
+
+    @property
+    def cube(self):
+        """(:obj:`CountCube`): Rows of current company employees."""
+        return self._view('cube', lambda: CountCube.combine(
+            [part.cube for part in self.iter_partitions()]))
+
+    @property
+    def person_cube(self):
+        """(:obj:`CountCube`): Unique current company employees."""
+        return self._view('person_cube', lambda: CountCube.combine(
+            [part.person_cube for part in self.iter_partitions()]))
+
+    @property
+    def company_cube(self):
+        """(:obj:`CountCube`): Men and women, once per company."""
+        return self._view('company_cube', lambda: CountCube.combine(
+            [part.company_cube for part in self.iter_partitions()]))
 
-    # 1. Gender diversity (city level)
-    country_gender = ind.people_diversity('country', 'gender')
+    def counts(self, *args, where=None, unique=False):
+        cube = self.person_cube if unique else self.cube
+        if set(args) | set(where or {}) <= set(cube.dims):
+            return cube.count(*args, where=where)
+        return add_counts([part.counts(*args, where=where, unique=unique)
+                           for part in self.iter_partitions()])
 
-    # 2. Ethnic diversity (city level)
-    country_ethnicity = ind.people_diversity('country', 'race')
+    def population(self, location='country', country=None):
+        return self._view(('population', location, country),
+                          lambda: add_counts([
+                              part.population(location, country)
+                              for part in self.iter_partitions()]))
 
-    # 3. Gender distribution for degrees
-    degree_gender = ind.degree_diversity('country', 'degree_type', 'gender')
+    def local_orgs(self, location='country'):
+        return self._view(('local_orgs', location), lambda: pd.concat(
+            [part.local_orgs(location).astype(object)
+             for part in self.iter_partitions()]).drop_duplicates())
 
-    # 4. Ethnic distribution for degrees
-    degree_ethnicity = ind.degree_diversity('country', 'degree_type', 'race')
+    def study_counts(self, location='country'):
+        def build():
+            local_orgs = self.local_orgs(location)
+            parts, missing = [], []
+            for part in self.iter_partitions():
+                parts.append(count_studies(part.data, location, local_orgs))
+                missing.append(missing_people(part.data,
+                                              location_columns(location)))
+            counts = add_counts(parts)
+            counts['all'] = dedupe_missing(counts['all'], missing)
+            return counts
+        return self._view(('study_counts', location), build)
 
-    # 5. Gender distribution for degrees - city level
-    degree_gender = ind.degree_diversity('country', 'degree_type', 'gender',
-                                         city_level=True, country='Germany')
+    def company_counts(self, location, cols, country=None):
+        parts, missing = [], []
+        for part in self.iter_partitions():
+            parts.append(part.company_counts(location, cols, country))
+            df = part.company_people
+            if country is not None:
+                df = df[df.country == country]
+            missing.append(missing_people(df, [location]))
+        return (dedupe_missing(add_counts([part[0] for part in parts]),
+                               missing),
+                add_counts([part[1] for part in parts]),
+                {col: add_counts([part[2][col] for part in parts])
+                 for col in cols})
 
-    # 6. Ethnic distribution for degrees - city level
-    degree_ethnicity = ind.degree_diversity('city', 'degree_type', 'race',
-                                            city_level=True, country='Germany')
 
-    # 7. Gender diversity in roles (city level)
-    role_comp_gender = ind.city_role_company('country', 'job_type', 'gender')
+def row_units(df):
+    """Find the unit of every row of the processed dataset: its person or,
+    for the rows without a person such as those of organisations without
+    jobs, its organisation.
 
-    # 8. Ethnic diversity in roles (city level)
-    role_comp_ethnicity = ind.city_role_company('country', 'job_type', 'race')
+    Args:
+        df (:obj:`pandas.DataFrame`)
 
-    # 9. Gender diversity in categories (city level)
-    cat_comp_gender = ind.city_role_company('country', 'category_group_list',
-                                            'gender')
+    Return:
+        (:obj:`pandas.MultiIndex`): Whether the unit is an organisation and
+            its ID.
 
-    # 10. Ethnic diversity in categories (city level)
-    cat_comp_ethnicity = ind.city_role_company('country',
-                                               'category_group_list', 'race')
+    """
+    person = np.asarray(df.person_id, dtype=object)
+    organisation = pd.isnull(person)
+    return pd.MultiIndex.from_arrays(
+        [organisation,
+         np.where(organisation, np.asarray(df.org_id, dtype=object), person)],
+        names=['organisation', 'id'])
 
-    # 11. Gender diversity in categories
-    cat_gender = ind.city_role_company('category_group_list', 'gender')
 
-    # 12. Ethnic diversity in categories
-    cat_ethnicity = ind.city_role_company('category_group_list', 'race')
+def unit_digests(df):
+    """Hash the rows of every unit, see row_units, in their order. Units
+    whose digests differ between two snapshots of the processed dataset have
+    changed.
 
-    # 13. Lieberson index (intersectionality) - city level
-    data_formatting = ind.lieberson_format(['gender', 'race'], city_level=True,
-                                           country='Germany')
-    lieberson_index_cities = {k: ind.lieberson_index(v)
-                              for k, v in data_formatting.items()}
+    Args:
+        df (:obj:`pandas.DataFrame`)
 
-    # 14. Lieberson index (intersectionality) - country level
-    data_formatting = ind.lieberson_format(['gender', 'race'],
-                                           country_level=True)
-    lieberson_index_countries = {k: ind.lieberson_index(v)
-                                 for k, v in data_formatting.items()}
+    Return:
+        (:obj:`pandas.Series`): Digests indexed by unit.
 
-    # 15. Studied at home vs abroad
-    work_and_study_place = {country: ind.home_study(country)
-                            for country in data.country.unique()}
+    """
+    units = row_units(df).to_frame(index=False)
+    df = df[[col for col in COLUMNS if col in df.columns]] \
+        .assign(position=units.groupby(list(units.columns),
+                                       sort=False).cumcount().values)
+    rows = pd.Series(pd.util.hash_pandas_object(df, index=False).values)
+    return rows.groupby([units.organisation, units.id]).sum()
+
+
+def read_units(path, units, chunksize=100000):
+    """Read the rows of some units, see row_units, from the processed
+    dataset. CSV and Parquet files are read in chunks, so that only the rows
+    of the units are held in memory.
+
+    Args:
+        path (:obj:`str`): Processed dataset, see read_processed.
+        units (:obj:`pandas.MultiIndex`): Units to read.
+        chunksize (:obj:`int`): Rows per chunk.
+
+    Return:
+        (:obj:`pandas.DataFrame`)
+
+    """
+    if not path.endswith(('.csv', '.parquet')):
+        df = read_processed(path, COLUMNS)
+        return df[row_units(df).isin(units)]
+    columns = [col for col in COLUMNS if col in read_columns(path)]
+    chunks = [chunk[row_units(chunk).isin(units)]
+              for chunk in iter_chunks(path, columns, chunksize)]
+    return pd.concat(chunks, ignore_index=True).astype(
+        {col: 'category' for col in columns if DTYPES.get(col) == 'category'})
+
+
+# People deduplicated on these locations give the unique people counts of
+# company_counts.
+PEOPLE_LOCATIONS = [('country',), ('city',), ('country', 'city')]
+# Locations of the home study counts, see location_columns.
+STUDY_LOCATIONS = ['country', 'city']
+
+
+def aggregate_counts(df, sign=1):
+    """Build the aggregates maintained by IncrementalIndicators. The home
+    study counts are kept as the rows of every location and organisation,
+    the people of every location and institution they studied in, the
+    people of every location and the rows of every location without a
+    person.
+
+    Args:
+        df (:obj:`pandas.DataFrame`): Rows of whole units, see row_units.
+        sign (:obj:`int`): -1 to retract the rows. Defaults to 1.
+
+    Return:
+        (:obj:`dict` of :obj:`CountCube`)
+
+    """
+    ind = Indicators(df)
+    cubes = {'cube': ind.cube, 'person_cube': ind.person_cube,
+             'company': ind.company_cube}
+    company_people = ind.company_people.dropna(subset=['person_id'])
+    for locations in PEOPLE_LOCATIONS:
+        cubes[locations] = CountCube(company_people.drop_duplicates(
+            ['person_id'] + list(locations)), locations)
+    for location in STUDY_LOCATIONS:
+        keys = location_columns(location)
+        rows = df.dropna(subset=keys)
+        people = rows.dropna(subset=['person_id'])
+        studies = keys + ['institution_id', 'person_id']
+        cubes['orgs', location] = CountCube(rows, keys + ['org_id'])
+        cubes['studies', location] = CountCube(
+            people.dropna(subset=['institution_id'])
+                  .drop_duplicates(studies), studies)
+        cubes['people', location] = CountCube(
+            people.drop_duplicates(keys + ['person_id']), keys)
+        cubes['missing', location] = CountCube(
+            rows[rows.person_id.isna()], keys)
+    for cube in cubes.values():
+        cube.cells['count'] *= sign
+    return cubes
+
+
+# Methods of IncrementalIndicators answered from its aggregates.
+MAINTAINED_METHODS = ['counts', 'population', 'people_diversity',
+                      'degree_diversity', 'city_role_company',
+                      'lieberson_format', 'lieberson_indices',
+                      'simpson_index', 'home_studies']
+
+
+class IncrementalIndicators(Indicators):
+    """Indicators kept up to date across snapshots of the processed dataset.
+
+    Only aggregate counts are kept: the count cubes, the company counts of
+    the diversity indices, the home study counts and a digest of the rows of
+    every unit, a person or an organisation without people (see row_units).
+    All of them add up over units, so update hashes the rows of the new
+    snapshot, compares the digests and only aggregates the old rows and the
+    new rows of the units that changed. These deltas are then added to the
+    cubes, which re-encodes their cells but not the rows of the snapshot.
+    Changes to an organisation or a job show up as changes to the rows of
+    their units.
+
+    Only MAINTAINED_METHODS broken down by CUBE_DIMENSIONS are maintained,
+    see supports. Other breakdowns need the rows of every person and raise
+    NotImplementedError.
+
+    Args:
+        data (:obj:`pandas.DataFrame` | :obj:`NoneType`): First snapshot.
+            Defaults to None.
+
+    """
+    def __init__(self, data=None):
+        super().__init__(None)
+        self.digests = pd.Series([], dtype='uint64',
+                                 index=pd.MultiIndex.from_arrays(
+                                     [[], []], names=['organisation', 'id']))
+        self.aggregates = {}
+        if data is not None:
+            self.update(data)
+
+    def update(self, data, previous=None):
+        """Move to a new snapshot.
+
+        Args:
+            data (:obj:`pandas.DataFrame`): New snapshot.
+            previous (:obj:`pandas.DataFrame` | :obj:`str` |
+                :obj:`NoneType`): Snapshot of the last update, needed if
+                units changed or left. If it is a path, only the rows of
+                these units are read, see read_units.
+
+        Return:
+            (:obj:`pandas.MultiIndex`, :obj:`pandas.MultiIndex`): The units
+                retracted and added.
+
+        """
+        digests = unit_digests(data)
+        same = digests.reindex(self.digests.index).values \
+            == self.digests.values
+        retracted = self.digests.index[~same]
+        added = digests.index.difference(self.digests.index[same])
+
+        deltas = [aggregate_counts(data[row_units(data).isin(added)])]
+        if len(retracted):
+            if previous is None:
+                raise ValueError('The previous snapshot is needed to retract '
+                                 'changed people.')
+            if isinstance(previous, str):
+                previous = read_units(previous, retracted)
+            else:
+                previous = previous[row_units(previous).isin(retracted)]
+            if not unit_digests(previous).sort_index().equals(
+                    self.digests.reindex(retracted).sort_index()):
+                raise ValueError('The previous snapshot is not the one of '
+                                 'the last update.')
+            deltas.append(aggregate_counts(previous, sign=-1))
+        if self.aggregates:
+            deltas.append(self.aggregates)
+        self.aggregates = {key: CountCube.combine([delta[key]
+                                                   for delta in deltas])
+                           for key in deltas[0]}
+        self.digests = digests
+        self._views = {}
+        return retracted, added
+
+    def supports(self, spec):
+        """Whether the indicator of a spec is maintained. The string args
+        of the spec, or the lists of strings, must be cube dimensions.
+
+        Args:
+            spec (:obj:`dict`): Indicator spec.
+
+        Return:
+            (:obj:`bool`)
+
+        """
+        columns = set()
+        for arg in spec.get('args', []):
+            if isinstance(arg, str):
+                columns.add(arg)
+            elif isinstance(arg, list):
+                columns.update(arg)
+        return spec['method'] in MAINTAINED_METHODS \
+            and columns <= set(self.cube.dims)
+
+    def __getstate__(self):
+        return {'digests': self.digests, 'aggregates': self.aggregates}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.__dict__.update(state)
+
+    @property
+    def cube(self):
+        """(:obj:`CountCube`): Rows of current company employees."""
+        return self.aggregates['cube']
+
+    @property
+    def person_cube(self):
+        """(:obj:`CountCube`): Unique current company employees."""
+        return self.aggregates['person_cube']
+
+    @property
+    def company_cube(self):
+        """(:obj:`CountCube`): Men and women, once per company."""
+        return self.aggregates['company']
+
+    def counts(self, *args, where=None, unique=False):
+        cube = self.person_cube if unique else self.cube
+        if not set(args) | set(where or {}) <= set(cube.dims):
+            raise NotImplementedError('Only breakdowns over the cube '
+                                      'dimensions are maintained.')
+        return cube.count(*args, where=where)
+
+    def population(self, location='country', country=None):
+        return self.person_cube.count(
+            location, where={'country': [country]} if country else None)
+
+    def study_counts(self, location='country'):
+        def build():
+            keys = location_columns(location)
+            orgs = self.aggregates['orgs', location].labelled_cells()
+            local = self.aggregates['studies', location].labelled_cells() \
+                .merge(orgs[keys + ['org_id']]
+                       .rename(columns={'org_id': 'institution_id'}),
+                       on=keys + ['institution_id']) \
+                .groupby(keys)['person_id'].nunique()
+            # Rows without a person count as one more person
+            people = self.aggregates['people', location].count(*keys).add(
+                self.aggregates['missing', location].count(*keys).clip(
+                    upper=1), fill_value=0).astype(np.int64)
+            return pd.DataFrame({
+                'local': local.reindex(people.index, fill_value=0),
+                'all': people})
+        return self._view(('study_counts', location), build)
+
+    def company_counts(self, location, cols, country=None):
+        where = {'country': [country]} if country is not None else None
+        locations = ('country', location) if where else (location,)
+        people = self.aggregates[tuple(dict.fromkeys(locations))]
+        company = self.aggregates['company']
+        return (people.count(location, where=where),
+                company.count(location, where=where),
+                {col: company.count(location, col, where=where)
+                 for col in cols})
+
+
+def indicator_specs(country='Germany'):
+    """Specs of the indicators computed by main. A spec names an Indicators
+    method and the args and kwargs it is called with.
+
+    Args:
+        country (:obj:`str`): Country of the city level indicators.
+
+    Return:
+        (:obj:`list` of :obj:`dict`)
+
+    """
+    return [
+        # 1. Gender diversity (city level)
+        {'name': 'country_gender', 'method': 'people_diversity',
+         'args': ['country', 'gender']},
+        # 2. Ethnic diversity (city level)
+        {'name': 'country_ethnicity', 'method': 'people_diversity',
+         'args': ['country', 'race']},
+        # 3. Gender distribution for degrees
+        {'name': 'degree_gender', 'method': 'degree_diversity',
+         'args': ['country', 'degree_type', 'gender']},
+        # 4. Ethnic distribution for degrees
+        {'name': 'degree_ethnicity', 'method': 'degree_diversity',
+         'args': ['country', 'degree_type', 'race']},
+        # 5. Gender distribution for degrees - city level
+        {'name': 'city_degree_gender', 'method': 'degree_diversity',
+         'args': ['city', 'degree_type', 'gender'],
+         'kwargs': {'city_level': True, 'country': country}},
+        # 6. Ethnic distribution for degrees - city level
+        {'name': 'city_degree_ethnicity', 'method': 'degree_diversity',
+         'args': ['city', 'degree_type', 'race'],
+         'kwargs': {'city_level': True, 'country': country}},
+        # 7. Gender diversity in roles (city level)
+        {'name': 'role_comp_gender', 'method': 'city_role_company',
+         'args': ['country', 'job_type', 'gender']},
+        # 8. Ethnic diversity in roles (city level)
+        {'name': 'role_comp_ethnicity', 'method': 'city_role_company',
+         'args': ['country', 'job_type', 'race']},
+        # 9. Gender diversity in categories (city level)
+        {'name': 'cat_comp_gender', 'method': 'city_role_company',
+         'args': ['country', 'category_group_list', 'gender']},
+        # 10. Ethnic diversity in categories (city level)
+        {'name': 'cat_comp_ethnicity', 'method': 'city_role_company',
+         'args': ['country', 'category_group_list', 'race']},
+        # 11. Gender diversity in categories
+        {'name': 'cat_gender', 'method': 'city_role_company',
+         'args': ['category_group_list', 'gender']},
+        # 12. Ethnic diversity in categories
+        {'name': 'cat_ethnicity', 'method': 'city_role_company',
+         'args': ['category_group_list', 'race']},
+        # 13. Lieberson index (intersectionality) - city level
+        {'name': 'lieberson_index_cities', 'method': 'lieberson_indices',
+         'args': [['gender', 'race'], 500],
+         'kwargs': {'city_level': True, 'country': country}},
+        # 14. Lieberson index (intersectionality) - country level
+        {'name': 'lieberson_index_countries', 'method': 'lieberson_indices',
+         'args': [['gender', 'race'], 1000],
+         'kwargs': {'country_level': True}},
+        # 15. Studied at home vs abroad
+        {'name': 'work_and_study_place', 'method': 'home_studies',
+         'args': ['country']},
+    ]
+
+
+def fingerprint(path):
+    """Hash the contents of a data file, or of the files of a directory.
+
+    Args:
+        path (:obj:`str`): File or directory.
+
+    Return:
+        (:obj:`str`): SHA-256 hex digest.
+
+    """
+    paths = [path] if not os.path.isdir(path) else \
+        [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    digest = hashlib.sha256()
+    for file_path in paths:
+        with open(file_path, 'rb') as h:
+            for block in iter(lambda: h.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def spec_key(data_fingerprint, spec):
+    """Address of the result of a spec computed on some data.
+
+    Args:
+        data_fingerprint (:obj:`str`): Output of fingerprint.
+        spec (:obj:`dict`): Indicator spec. The name is not part of the key.
+
+    Return:
+        (:obj:`str`): SHA-256 hex digest.
+
+    """
+    content = json.dumps([data_fingerprint, spec['method'],
+                          spec.get('args', []), spec.get('kwargs', {})],
+                         sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+# Indicators of a worker process of run_indicators.
+_worker = {}
+# Workers are forked to share the memory of the parent. Specs run in the
+# parent where processes cannot be forked.
+FORK = multiprocessing.get_context('fork') \
+    if 'fork' in multiprocessing.get_all_start_methods() else None
+# Views used by most specs, built by the parent before the workers start.
+SHARED_VIEWS = ['cube', 'person_cube', 'unique_employees', 'company_people']
+
+
+def init_worker(ind):
+    """Set the Indicators of a worker process. Forked workers share the
+    memory of the Indicators loaded by the parent, so it is neither copied
+    nor read again."""
+    _worker['indicators'] = ind
+
+
+def run_spec(spec, ind=None):
+    """Compute the indicator of a spec.
+
+    Args:
+        spec (:obj:`dict`): Indicator spec.
+        ind (:obj:`Indicators` | :obj:`NoneType`): Defaults to the Indicators
+            of the worker process.
+
+    """
+    ind = ind or _worker['indicators']
+    with profiling.stage(spec['name'], ind.data) as stage:
+        return stage.output(getattr(ind, spec['method'])(
+            *spec.get('args', []), **spec.get('kwargs', {})))
+
+
+def run_indicators(path, specs, cache_dir=None, n_jobs=None):
+    """Compute indicator specs on the processed dataset, in parallel. Results
+    are cached on disk by the contents of the data and the spec, so only new
+    or changed specs are computed again.
+
+    Args:
+        path (:obj:`str`): Processed dataset, see read_processed.
+        specs (:obj:`list` of :obj:`dict`): Indicator specs with a name, an
+            Indicators method and optionally its args and kwargs.
+        cache_dir (:obj:`str` | :obj:`NoneType`): Results cache. Defaults to
+            None.
+        n_jobs (:obj:`int` | :obj:`NoneType`): Number of processes. They are
+            forked after the data is loaded, once, by this process. Defaults
+            to the number of CPUs.
+
+    Return:
+        (:obj:`dict`): Spec names mapped to their results.
+
+    """
+    results = {}
+    todo = specs
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        data_fingerprint = fingerprint(path)
+        paths = {spec['name']: os.path.join(cache_dir, '{}.pickle'.format(
+            spec_key(data_fingerprint, spec))) for spec in specs}
+        todo = []
+        for spec in specs:
+            if os.path.exists(paths[spec['name']]):
+                with open(paths[spec['name']], 'rb') as h:
+                    results[spec['name']] = pickle.load(h)
+            else:
+                todo.append(spec)
+
+    n_jobs = min(n_jobs or os.cpu_count(), len(todo))
+    computed = []
+    if todo:
+        with profiling.stage('read_processed') as stage:
+            ind = Indicators(stage.output(compact(read_processed(path,
+                                                                 COLUMNS))))
+    if n_jobs > 1 and FORK is not None:
+        for view in SHARED_VIEWS:
+            getattr(ind, view)
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=FORK,
+                                 initializer=init_worker,
+                                 initargs=(ind,)) as pool:
+            computed = list(pool.map(run_spec, todo))
+    elif todo:
+        computed = [run_spec(spec, ind) for spec in todo]
+
+    for spec, result in zip(todo, computed):
+        results[spec['name']] = result
+        if cache_dir is not None:
+            # Moved into place once written, so that an interrupted write
+            # never leaves a truncated result in the cache
+            tmp_path = '{}.{}.tmp'.format(paths[spec['name']], os.getpid())
+            with open(tmp_path, 'wb') as h:
+                pickle.dump(result, h)
+            os.replace(tmp_path, paths[spec['name']])
+    return results
+
+
+def update_indicators(path, previous_path, specs, state_path):
+    """Update indicator specs for a new snapshot of the processed dataset,
+    from the IncrementalIndicators of the previous one. The new snapshot is
+    read in full and only the rows of the units that changed are read from
+    the previous one; only their aggregates are computed. Specs that are not
+    maintained incrementally, see IncrementalIndicators.supports, are
+    computed on the whole snapshot.
+
+    Args:
+        path (:obj:`str`): New processed dataset, see read_processed.
+        previous_path (:obj:`str`): Processed dataset of the last update.
+        specs (:obj:`list` of :obj:`dict`): Indicator specs.
+        state_path (:obj:`str`): Pickle of the IncrementalIndicators. It is
+            created from the new snapshot if it does not exist.
+
+    Return:
+        (:obj:`dict`): Spec names mapped to their results.
+
+    """
+    data = read_processed(path, COLUMNS)
+    if os.path.exists(state_path):
+        with open(state_path, 'rb') as h:
+            ind = pickle.load(h)
+        ind.update(data, previous_path)
+    else:
+        ind = IncrementalIndicators(data)
+    with open(state_path, 'wb') as h:
+        pickle.dump(ind, h)
+
+    results = {}
+    full = None
+    for spec in specs:
+        if ind.supports(spec):
+            results[spec['name']] = run_spec(spec, ind)
+        else:
+            full = full or Indicators(data)
+            results[spec['name']] = run_spec(spec, full)
+    return results
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    country = args[1] if len(args) > 1 else 'Germany'
+    if '--profile' not in sys.argv:
+        results = run_indicators(args[0], indicator_specs(country),
+                                 cache_dir=RESULTS_CACHE_DIR)
+    else:
+        # Stages are only recorded in this process, and none are skipped
+        profiling.enable()
+        results = run_indicators(args[0], indicator_specs(country), n_jobs=1)
+        profiling.write_report(profiling.disable(), PROFILE_REPORT)
+    print('Computed {} indicators'.format(len(results)))
 
 
 if __name__ == '__main__':
@@ -45,3 +45,23 @@ ethnicities = [
  'GreaterEuropean,WestEuropean,Hispanic',
  'GreaterEuropean,WestEuropean,Italian', 'GreaterEuropean,WestEuropean,Nordic'
  ]
+
+# Columns of the normalised tables of the processed dataset. The first column
+# of each table is its key.
+tables = {
+ 'orgs': [
+  'org_id', 'funding_total_usd', 'founded_on', 'city', 'country',
+  'employee_count', 'primary_role', 'country_alpha_2', 'country_alpha_3',
+  'continent', 'latitude', 'longitude'
+  ],
+ 'jobs': ['job_id', 'org_id', 'person_id', 'is_current', 'job_type'],
+ 'org_categories': ['org_id', 'category_group_list'],
+ 'people': ['person_id', 'first_name', 'last_name', 'gender', 'race'],
+ 'degrees': ['degree_id', 'person_id', 'degree_type', 'institution_id']
+ }
+
+categoricals = [
+ 'city', 'country', 'employee_count', 'primary_role', 'country_alpha_2',
+ 'country_alpha_3', 'continent', 'job_type', 'category_group_list', 'gender',
+ 'race', 'degree_type'
+ ]
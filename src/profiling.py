@@ -0,0 +1,200 @@
+import csv
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Columns of a profiling report.
+FIELDS = ['stage', 'wall_time', 'cpu_time', 'start_rss', 'peak_rss',
+          'peak_growth', 'rows_in', 'rows_out', 'frame_bytes']
+
+# Memory of the process on Linux. Writing 5 to clear_refs resets the peak
+# resident memory, VmHWM, to the current one.
+STATUS_PATH = '/proc/self/status'
+CLEAR_REFS_PATH = '/proc/self/clear_refs'
+
+# Stages recorded since enable was called. None while profiling is off.
+_records = None
+# Names of the stages running in each thread.
+_local = threading.local()
+# Peak memory so far of the stages running in any thread. The peak is reset
+# for the whole process, so it is recorded in all of them before a reset.
+_peaks = {}
+_peaks_lock = threading.Lock()
+
+
+def enable():
+    """Start recording stages, dropping those recorded before."""
+    global _records
+    _records = []
+
+
+def disable():
+    """Stop recording stages.
+
+    Return:
+        (:obj:`list` of :obj:`dict`): The recorded stages.
+
+    """
+    global _records
+    records, _records = _records or [], None
+    return records
+
+
+def n_rows(obj):
+    """(:obj:`int` | :obj:`NoneType`): Length of a frame or a collection."""
+    try:
+        return len(obj)
+    except TypeError:
+        return None
+
+
+def frame_bytes(obj):
+    """(:obj:`int` | :obj:`NoneType`): Memory used by a DataFrame or a
+    Series, including the strings it holds."""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True, index=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True, index=True))
+    return None
+
+
+def read_status(field):
+    """Read a memory field of the process status, e.g. VmRSS.
+
+    Args:
+        field (:obj:`str`): Field name.
+
+    Return:
+        (:obj:`int`): Bytes. Where there is no process status, the peak
+            resident memory of the process since it started.
+
+    """
+    try:
+        with open(STATUS_PATH) as h:
+            for line in h:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def rss():
+    """(:obj:`int`): Resident memory of the process, in bytes."""
+    return read_status('VmRSS')
+
+
+def peak_rss():
+    """(:obj:`int`): Peak resident memory of the process since the last
+    reset_peak, in bytes."""
+    return read_status('VmHWM')
+
+
+def reset_peak():
+    """Reset the peak resident memory of the process to the current one,
+    where the system allows it."""
+    try:
+        with open(CLEAR_REFS_PATH, 'w') as h:
+            h.write('5')
+    except OSError:
+        pass
+
+
+def observe_peak():
+    """Record the peak memory since the last reset in every running stage,
+    before it is reset again or a stage ends. Must hold _peaks_lock."""
+    peak = peak_rss()
+    for key, stage_peak in _peaks.items():
+        _peaks[key] = max(stage_peak, peak)
+
+
+class Stage():
+    """Output of a profiled stage.
+
+    Args:
+        data: Main input of the stage, e.g. the left side of a merge.
+
+    """
+    def __init__(self, data=None):
+        self.data = data
+        self.out = None
+
+    def output(self, out):
+        """Record the output of the stage and return it."""
+        self.out = out
+        return out
+
+
+@contextmanager
+def stage(name, data=None):
+    """Profile a block of code: its wall time, the CPU time of the process,
+    the resident memory at its start, the peak resident memory during the
+    block and its growth over the start, the rows of its main input and of
+    its output and the memory used by its output. Nested stages are named
+    after their parents, e.g. merge_tables/merge_jobs. Nothing is measured
+    while profiling is off.
+
+    The peak is reset at the start of every stage on Linux. Elsewhere it is
+    the peak of the process since it started. Memory is measured for the
+    whole process, so stages running in other threads add to it.
+
+    Args:
+        name (:obj:`str`): Stage name.
+        data: Main input of the stage. Defaults to None.
+
+    Yield:
+        (:obj:`Stage`): Pass the output of the block to its output method.
+
+    """
+    current = Stage(data)
+    if _records is None:
+        yield current
+        return
+
+    parents = getattr(_local, 'stack', [])
+    with _peaks_lock:
+        observe_peak()
+        reset_peak()
+        start_rss = rss()
+        _peaks[id(current)] = start_rss
+    _local.stack = parents + [name]
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield current
+    finally:
+        _local.stack = parents
+        with _peaks_lock:
+            observe_peak()
+            peak = _peaks.pop(id(current))
+    _records.append({
+        'stage': '/'.join(parents + [name]),
+        'wall_time': time.perf_counter() - wall,
+        'cpu_time': time.process_time() - cpu,
+        'start_rss': start_rss,
+        'peak_rss': peak,
+        'peak_growth': peak - start_rss,
+        'rows_in': n_rows(data) if data is not None else None,
+        'rows_out': n_rows(current.out) if current.out is not None else None,
+        'frame_bytes': frame_bytes(current.out)})
+
+
+def write_report(records, path):
+    """Write profiled stages as JSON or, if the path ends with .csv, as CSV.
+
+    Args:
+        records (:obj:`list` of :obj:`dict`): Output of disable.
+        path (:obj:`str`): Report file.
+
+    """
+    with open(path, 'w', newline='') as h:
+        if path.endswith('.csv'):
+            writer = csv.DictWriter(h, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            json.dump(records, h, indent=2)
@@ -0,0 +1,194 @@
+import sys
+import json
+import inspect
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from indicators import COLUMNS, Indicators, compact, read_processed
+
+# Indicators methods that can be queried.
+QUERY_METHODS = [
+    'counts', 'category_group_counts', 'population', 'people_diversity',
+    'degree_diversity', 'city_role_company', 'home_studies', 'home_study',
+    'lieberson_format', 'lieberson_indices', 'simpson_index',
+    'people_diversity_bootstrap', 'lieberson_bootstrap', 'simpson_bootstrap']
+ARROW_MIME_TYPE = 'application/vnd.apache.arrow.stream'
+
+
+def as_frame(result):
+    """Lay out the result of a query as a table.
+
+    Args:
+        result: Output of an Indicators method.
+
+    Return:
+        (:obj:`pandas.DataFrame` | :obj:`NoneType`): The result with its index
+            as columns, or None if it is not tabular, e.g. nested dicts.
+
+    """
+    if isinstance(result, pd.Series):
+        name = result.name
+        if name is None or name in result.index.names:
+            name = 'value'
+        return result.rename(name).reset_index()
+    if isinstance(result, pd.DataFrame):
+        return result.reset_index()
+    if isinstance(result, dict):
+        if any(isinstance(value, (dict, list)) for value in result.values()):
+            return None
+        return pd.DataFrame({'key': list(result),
+                             'value': list(result.values())},
+                            columns=['key', 'value'])
+    if isinstance(result, (pd.Index, np.ndarray, list)):
+        return pd.DataFrame({'value': list(result)})
+    return pd.DataFrame({'value': [result]})
+
+
+def to_arrow(result):
+    """Serialise the result of a query as an Arrow IPC stream.
+
+    Return:
+        (:obj:`bytes`)
+
+    """
+    df = as_frame(result)
+    if df is None:
+        raise ValueError('The result is not tabular, use JSON.')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    writer = pa.RecordBatchStreamWriter(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    return sink.getvalue().to_pybytes()
+
+
+def to_json(result):
+    """Serialise the result of a query as JSON records, or as it is if it is
+    not tabular. Missing values are null.
+
+    Return:
+        (:obj:`str`)
+
+    """
+    df = as_frame(result)
+    if df is None:
+        return json.dumps(result)
+    return df.to_json(orient='records')
+
+
+class QueryService():
+    """Answer Indicators queries on a processed dataset that is loaded once.
+    Results are kept in a least recently used cache keyed by the method and
+    the values of all its arguments, e.g. the thresh and the country, with
+    their defaults filled in. Repeating a query while exploring costs
+    nothing, however its arguments are passed.
+
+    Args:
+        path (:obj:`str`): Processed dataset, see read_processed.
+        maxsize (:obj:`int`): Number of results cached. Defaults to 256.
+
+    """
+    def __init__(self, path, maxsize=256):
+        self.indicators = Indicators(compact(read_processed(path, COLUMNS)))
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+
+    def query(self, method, *args, **kwargs):
+        """Call an Indicators method, or return its cached result.
+
+        Args:
+            method (:obj:`str`): One of QUERY_METHODS.
+            *args, **kwargs: Arguments of the method. They must be JSON
+                serialisable.
+
+        Return:
+            The output of the method. It is shared with the cache and should
+            not be modified.
+
+        """
+        if method not in QUERY_METHODS:
+            raise ValueError('Unknown query {}'.format(method))
+        call = inspect.signature(getattr(self.indicators, method)) \
+            .bind(*args, **kwargs)
+        call.apply_defaults()
+        key = json.dumps([method, call.arguments], sort_keys=True)
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key]
+        result = getattr(self.indicators, method)(*args, **kwargs)
+        self._results[key] = result
+        if len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+        return result
+
+    def query_arrow(self, method, *args, **kwargs):
+        """(:obj:`bytes`): A query serialised by to_arrow."""
+        return to_arrow(self.query(method, *args, **kwargs))
+
+    def query_json(self, method, *args, **kwargs):
+        """(:obj:`str`): A query serialised by to_json."""
+        return to_json(self.query(method, *args, **kwargs))
+
+
+def parse_query(url):
+    """Read a query from a URL such as
+    /people_diversity?args=["city", "gender"]&thresh=25&format=arrow. Values
+    are parsed as JSON, or kept as strings if they are not JSON.
+
+    Return:
+        (:obj:`str`, :obj:`list`, :obj:`dict`, :obj:`str`): The method, its
+            args and kwargs and the format, json or arrow.
+
+    """
+    url = urlparse(url)
+    kwargs = {}
+    for name, value in parse_qsl(url.query):
+        try:
+            kwargs[name] = json.loads(value)
+        except ValueError:
+            kwargs[name] = value
+    args = kwargs.pop('args', [])
+    fmt = kwargs.pop('format', 'json')
+    return url.path.strip('/'), args, kwargs, fmt
+
+
+def serve(service, host='127.0.0.1', port=8050):
+    """Answer queries of a QueryService over HTTP, see parse_query.
+
+    Args:
+        service (:obj:`QueryService`)
+        host (:obj:`str`): Defaults to localhost only.
+        port (:obj:`int`)
+
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            try:
+                method, args, kwargs, fmt = parse_query(self.path)
+                if fmt == 'arrow':
+                    body = service.query_arrow(method, *args, **kwargs)
+                    content_type = ARROW_MIME_TYPE
+                else:
+                    body = service.query_json(method, *args, **kwargs) \
+                        .encode('utf-8')
+                    content_type = 'application/json'
+            except (ValueError, TypeError, KeyError) as e:
+                self.send_error(400, str(e))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    HTTPServer((host, port), Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8050
+    serve(QueryService(sys.argv[1]), port=port)
@@ -0,0 +1,257 @@
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from lists import postgrad, undergrad, phil, mba, judge
+
+# Countries of the locations, with their codes, continent and share of the
+# locations.
+COUNTRIES = [
+    ('United States', 'US', 'USA', 'North America', 0.30),
+    ('United Kingdom', 'GB', 'GBR', 'Europe', 0.12),
+    ('Germany', 'DE', 'DEU', 'Europe', 0.08),
+    ('France', 'FR', 'FRA', 'Europe', 0.07),
+    ('Spain', 'ES', 'ESP', 'Europe', 0.05),
+    ('Netherlands', 'NL', 'NLD', 'Europe', 0.04),
+    ('Italy', 'IT', 'ITA', 'Europe', 0.04),
+    ('Sweden', 'SE', 'SWE', 'Europe', 0.03),
+    ('Ireland', 'IE', 'IRL', 'Europe', 0.02),
+    ('Poland', 'PL', 'POL', 'Europe', 0.02),
+    ('Denmark', 'DK', 'DNK', 'Europe', 0.02),
+    ('Finland', 'FI', 'FIN', 'Europe', 0.01),
+    ('Canada', 'CA', 'CAN', 'North America', 0.06),
+    ('India', 'IN', 'IND', 'Asia', 0.08),
+    ('China', 'CN', 'CHN', 'Asia', 0.06),
+]
+
+CATEGORY_GROUPS = [
+    'Software', 'Internet Services', 'Information Technology', 'Hardware',
+    'Health Care', 'Financial Services', 'Commerce and Shopping',
+    'Media and Entertainment', 'Data and Analytics',
+    'Artificial Intelligence', 'Mobile', 'Science and Engineering',
+    'Manufacturing', 'Real Estate', 'Education', 'Transportation', 'Energy',
+    'Food and Beverage', 'Biotechnology', 'Sustainability']
+
+EMPLOYEE_COUNTS = (['1-10', '11-50', '51-100', '101-250', '251-500',
+                    '501-1000', '1001-5000', '5001-10000', '10000+',
+                    'unknown', None],
+                   [.38, .25, .08, .06, .03, .02, .02, .005, .005, .1, .04])
+GENDERS = (['male', 'female', 'not_provided', None], [.62, .15, .03, .2])
+JOB_TYPES = (['employee', 'executive', 'board_member', 'advisor', None],
+             [.45, .25, .15, .1, .05])
+DEGREE_TYPES = postgrad + undergrad + phil + mba + judge + [
+    'unknown', 'Unknown', 'Diploma', 'High School', None]
+
+# Sizes of the tables, relative to the organisations.
+N_LOCATIONS = 0.02
+N_CATEGORIES = 700
+PEOPLE_PER_ORG = 1.2
+CATEGORIES_PER_ORG = 2.5
+JOBS_PER_PERSON = 1.3
+DEGREES_PER_PERSON = 0.6
+ROWS_PER_ORG = 1 + CATEGORIES_PER_ORG + PEOPLE_PER_ORG * (
+    1 + JOBS_PER_PERSON + DEGREES_PER_PERSON)
+
+# One organisation in SCHOOL_EVERY is a school, one in INVESTOR_EVERY an
+# investor.
+SCHOOL_EVERY = 12
+INVESTOR_EVERY = 25
+
+
+def skewed(rng, n, size, power=3):
+    """Draw integers in [0, n) with a long tail: low values are the most
+    frequent, like the largest companies or cities.
+
+    Args:
+        rng (:obj:`numpy.random.RandomState`)
+        n (:obj:`int`): Number of values.
+        size (:obj:`int`): Number of draws.
+        power (:obj:`float`): Skew. 1 draws uniformly.
+
+    Return:
+        (:obj:`numpy.ndarray`)
+
+    """
+    return (n * rng.random_sample(size) ** power).astype(np.int64)
+
+
+def choice(rng, values, size):
+    """Draw from a (values, probabilities) pair."""
+    values, p = values
+    return np.array(values, dtype=object)[rng.choice(len(values), size,
+                                                     p=np.divide(p, sum(p)))]
+
+
+def ids(prefix, values):
+    """(:obj:`numpy.ndarray`): String IDs of integers."""
+    return np.char.add(prefix, np.asarray(values).astype(str)).astype(object)
+
+
+def dates(rng, start, days, size):
+    """Random dates from start."""
+    return np.datetime64(start) + rng.randint(0, days, size) \
+        .astype('timedelta64[D]')
+
+
+def geographic_data(rng, n):
+    """Locations, each in a different city."""
+    countries = np.array(COUNTRIES, dtype=object)
+    weights = countries[:, 4].astype(float)
+    country = rng.choice(len(countries), n, p=weights / weights.sum())
+    return pd.DataFrame({
+        'id': ids('loc-', np.arange(n)),
+        'city': ids('City ', np.arange(n)),
+        'country': countries[country, 0],
+        'country_alpha_2': countries[country, 1],
+        'country_alpha_3': countries[country, 2],
+        'continent': countries[country, 3],
+        'latitude': rng.uniform(-60, 70, n),
+        'longitude': rng.uniform(-180, 180, n)})
+
+
+def category_groups(rng):
+    """Categories and the one to three groups they belong to."""
+    n_groups = 1 + skewed(rng, 3, N_CATEGORIES, power=2)
+    return pd.DataFrame({
+        'category_name': ids('category-', np.arange(N_CATEGORIES)),
+        'category_group_list': [
+            ','.join(rng.choice(CATEGORY_GROUPS, k, replace=False))
+            for k in n_groups]})
+
+
+def organizations(rng, start, stop, n_locations):
+    """Organisations with IDs in [start, stop)."""
+    size = stop - start
+    org = np.arange(start, stop)
+    funding = rng.lognormal(14, 2, size)
+    return pd.DataFrame({
+        'id': ids('org-', org),
+        'funding_total_usd': np.where(rng.random_sample(size) < .6, np.nan,
+                                      funding),
+        'founded_on': dates(rng, '1980-01-01', 14000, size).astype(str),
+        'employee_count': choice(rng, EMPLOYEE_COUNTS, size),
+        'primary_role': np.where(org % SCHOOL_EVERY == 0, 'school',
+                                 np.where(org % INVESTOR_EVERY == 1,
+                                          'investor', 'company')),
+        'location_id': ids('loc-', skewed(rng, n_locations, size)),
+        'updated_at': dates(rng, '2018-01-01', 700, size)})
+
+
+def organizations_categories(rng, start, stop):
+    """Categories of the organisations with IDs in [start, stop)."""
+    counts = 1 + rng.poisson(CATEGORIES_PER_ORG - 1, stop - start)
+    return pd.DataFrame({
+        'organization_id': ids('org-', np.repeat(np.arange(start, stop),
+                                                 counts)),
+        'category_name': ids('category-', skewed(rng, N_CATEGORIES,
+                                                 counts.sum(), power=2))})
+
+
+def people(rng, start, stop):
+    """People with IDs in [start, stop)."""
+    size = stop - start
+    return pd.DataFrame({
+        'id': ids('person-', np.arange(start, stop)),
+        'first_name': ids('First', skewed(rng, 20000, size)),
+        'last_name': ids('Last', skewed(rng, 200000, size, power=2)),
+        'gender': choice(rng, GENDERS, size),
+        'updated_at': dates(rng, '2018-01-01', 700, size)})
+
+
+def jobs(rng, start, stop, n_orgs, offset):
+    """Jobs of the people with IDs in [start, stop), numbered from
+    offset."""
+    counts = 1 + rng.poisson(JOBS_PER_PERSON - 1, stop - start)
+    size = counts.sum()
+    return pd.DataFrame({
+        'person_id': ids('person-', np.repeat(np.arange(start, stop),
+                                              counts)),
+        'org_id': ids('org-', skewed(rng, n_orgs, size)),
+        'job_id': ids('job-', np.arange(offset, offset + size)),
+        'is_current': (rng.random_sample(size) < .45).astype(float),
+        'job_type': choice(rng, JOB_TYPES, size),
+        'updated_at': dates(rng, '2018-01-01', 700, size)})
+
+
+def degrees(rng, start, stop, n_orgs, offset):
+    """Degrees of the people with IDs in [start, stop), from schools and
+    numbered from offset."""
+    counts = rng.poisson(DEGREES_PER_PERSON, stop - start)
+    size = counts.sum()
+    return pd.DataFrame({
+        'person_id': ids('person-', np.repeat(np.arange(start, stop),
+                                              counts)),
+        'degree_type': np.array(DEGREE_TYPES, dtype=object)[
+            skewed(rng, len(DEGREE_TYPES), size, power=2)],
+        'degree_id': ids('degree-', np.arange(offset, offset + size)),
+        'institution_id': ids('org-', SCHOOL_EVERY * skewed(
+            rng, -(-n_orgs // SCHOOL_EVERY), size)),
+        'updated_at': dates(rng, '2018-01-01', 700, size)})
+
+
+def iter_tables(n_rows=100000, seed=0, chunksize=1000000):
+    """Generate Crunchbase-like tables, in chunks. Companies, cities,
+    categories and names are drawn with a long tail and every person has one
+    job or more and maybe some degrees, so that the merges of prepare_data
+    grow the rows like the real data.
+
+    Args:
+        n_rows (:obj:`int`): Approximate number of rows of all the tables.
+        seed (:obj:`int`): Seed of the random generator.
+        chunksize (:obj:`int`): Organisations or people per chunk.
+
+    Yield:
+        (:obj:`str`, :obj:`pandas.DataFrame`): Table name and rows.
+
+    """
+    rng = np.random.RandomState(seed)
+    n_orgs = max(100, int(n_rows / ROWS_PER_ORG))
+    n_people = int(n_orgs * PEOPLE_PER_ORG)
+    n_locations = max(20, int(n_orgs * N_LOCATIONS))
+
+    yield 'geographic_data', geographic_data(rng, n_locations)
+    yield 'crunchbase_category_groups', category_groups(rng)
+    for start in range(0, n_orgs, chunksize):
+        stop = min(start + chunksize, n_orgs)
+        yield 'crunchbase_organizations', organizations(rng, start, stop,
+                                                        n_locations)
+        yield 'crunchbase_organizations_categories', \
+            organizations_categories(rng, start, stop)
+
+    n_jobs = n_degrees = 0
+    for start in range(0, n_people, chunksize):
+        stop = min(start + chunksize, n_people)
+        yield 'crunchbase_people', people(rng, start, stop)
+        df = jobs(rng, start, stop, n_orgs, n_jobs)
+        n_jobs += df.shape[0]
+        yield 'crunchbase_jobs', df
+        df = degrees(rng, start, stop, n_orgs, n_degrees)
+        n_degrees += df.shape[0]
+        yield 'crunchbase_degrees', df
+
+
+def sqlite_engine(config_file):
+    """Stand-in for data_getters.core.get_engine that connects to a SQLite
+    file instead of the database of the config file."""
+    return create_engine('sqlite:///{}'.format(config_file))
+
+
+def write_database(path, n_rows=100000, seed=0, chunksize=1000000):
+    """Write synthetic tables to a new SQLite file, see iter_tables.
+
+    Return:
+        (:obj:`dict`): Table names mapped to their number of rows.
+
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    engine = sqlite_engine(path)
+    sizes = {}
+    for table, df in iter_tables(n_rows, seed, chunksize):
+        df.to_sql(table, engine, index=False, if_exists='append',
+                  chunksize=100000)
+        sizes[table] = sizes.get(table, 0) + df.shape[0]
+    engine.dispose()
+    return sizes